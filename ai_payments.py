@@ -1,11 +1,29 @@
-import os
-from openai import OpenAI, APIConnectionError, APIError, APIStatusError
+import copy
 import json
 import logging
 
-logging.basicConfig(level=logging.INFO, filename='payment_streams.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
-
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from api_client import (
+    async_chat_completion, async_chat_completion_stream, chat_completion, chat_completion_stream, get_client
+)
+from config_delta import apply_delta, build_delta_prompt, parse_delta
+from interaction_store import get_store
+from metrics import count, timed
+from model_tiers import acomplete_update, cache_model, complete_update, strongest_model
+from near_duplicates import seen_before
+from resilience import CircuitOpenError
+from response_cache import make_key, response_cache
+from rule_extractor import extract as extract_rules
+import schema_registry
+from single_flight import coalesce
+from startup import run_once
+from stream_parser import aiter_stream_fields, iter_stream_fields
+from structured_logging import attach_log_file
+from training_pipeline import fine_tune
+
+LOG_FILE = 'payment_streams.log'
+logger = logging.getLogger("ai_payments")
+
+MODEL = "gpt-3.5-turbo"
 
 PROTOCOL_FIELDS = {
     "Asset Type": ["Equity Tokens", "Real Estate", "Watches", "Vehicles", "Not defined"],
@@ -18,10 +36,32 @@ PROTOCOL_FIELDS = {
     "Pause Payments": ["Yes", "No", "Not defined"],
     "Pause Payments by": ["Creator/Myself", "Whitelisted addresses", "Not defined"],
     "Admin": ["Creator"],
-    "Managers": ["Whitelisted addresses", "Creator" "Not defined"],
+    "Managers": ["Whitelisted addresses", "Creator", "Not defined"],
     "Manager Permissions": ["Input payments", "Change data", "Withdraw funds", "Delete payment stream", "Not defined"]
 }
 
+DEFAULT_CONFIG = {
+    "Asset Type": "Not defined",
+    "Payer": "Creator",
+    "Input Payment Frequency": "Not defined",
+    "Input Payment Amount": "Not defined",
+    "Output Payment Distribution": "Not defined",
+    "Distribution Frequency": "Not defined",
+    "Distribute to": "Not defined",
+    "Pause Payments": "Not defined",
+    "Pause Payments by": "Not defined",
+    "Admin": "Creator",
+    "Managers": "Not defined",
+    "Manager Permissions": "Not defined"
+}
+
+SCHEMA = schema_registry.register(
+    "ai_payments.py", PROTOCOL_FIELDS,
+    field_types={"Input Payment Amount": "amount"},
+    defaults=DEFAULT_CONFIG,
+    fallback="Not defined"
+)
+
 PROMPT_TEMPLATE = """
 You are an advanced AI assistant specialized in financial payment streams. Your task is to extract, analyze, and process detailed payment stream configurations from the user's input. The user may describe a variety of financial use cases, including but not limited to dividend payments, subscriptions, rent, salaries, and other recurring or one-time payment structures. You must interpret the financial context and determine the appropriate parameters for the payment stream. When the user writes "my", "me", "I", "myself", etc, he means the (=) "Creator". Meaning user = "Creator", do not write "User".
 
@@ -37,55 +77,145 @@ User's new input or requested changes:
 Update the payment stream configuration based on the user's input. If a field is not mentioned or changed, keep its previous value. Provide ONLY ONE updated JSON-like output, strictly adhering to the predefined fields and options. Do not include any explanations or additional text, just the single, final JSON object:
 """
 
+@run_once
+def init():
+    """Attach the module's log file. Runs on first use, or call it at startup."""
+    attach_log_file(logger, LOG_FILE)
+
+def validate_field(field, value):
+    """Return the value if it is allowed for the field, otherwise "Not defined"."""
+    return SCHEMA.validate_field(field, value)
+
 def validate_config(config):
     """Validate and correct the configuration based on protocol fields."""
-    for field, value in config.items():
-        if field == "Input Payment Amount":
-            if value != "Not defined" and not (value.startswith("ETH ") or value.startswith("EUR ")):
-                config[field] = "Not defined"
-        elif field in PROTOCOL_FIELDS:
-            if value not in PROTOCOL_FIELDS[field]:
-                config[field] = "Not defined"
-    return config
+    return SCHEMA.validate(config)[0]
+
+def build_messages(user_input: str, current_config: dict) -> list:
+    """Build the chat messages for a payment stream update."""
+    return [
+        {"role": "system", "content": "You are a specialized AI assistant for updating payment stream configurations."},
+        {"role": "user", "content": build_delta_prompt(current_config, user_input)}
+    ]
 
+def parse_response(response_text: str, current_config: dict) -> dict:
+    """Apply the changed fields from the model output, or return None if there is no JSON object."""
+    with timed("ai_payments.py", "parse"):
+        delta = parse_delta(response_text)
+    if delta is None:
+        print("Failed to update configuration. Keeping current configuration.")
+        return None
+    with timed("ai_payments.py", "validation"):
+        return apply_delta(current_config, delta, PROTOCOL_FIELDS, validate_field)
+
+def rule_updates(user_input: str, current_config: dict):
+    """Return the validated rule-based updates if they explain the whole input, otherwise None."""
+    with timed("ai_payments.py", "rules"):
+        updates, explained = extract_rules("ai_payments.py", user_input, current_config)
+    if not explained:
+        return None
+    return {field: validate_field(field, value) for field, value in updates.items()}
+
+def fallback_updates(user_input: str, current_config: dict) -> dict:
+    """Apply whatever the rules recognised, for when the API is refusing calls."""
+    updates, _ = extract_rules("ai_payments.py", user_input, current_config)
+    return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
+
+@coalesce("ai_payments.py", MODEL)
 def create_or_update_payment_stream(user_input: str, current_config: dict) -> dict:
-    try:
-        client = OpenAI()
-        
-        prompt = f"""
-Given the current configuration:
-{json.dumps(current_config, indent=2)}
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_payments.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
+
+    cache_key = make_key("ai_payments.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_payments.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_payments.py", "cache")
+        return cached_config
 
-And the user input:
-"{user_input}"
+    try:
+        with timed("ai_payments.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        updated_config = complete_update(
+            "ai_payments.py", MODEL, SCHEMA, user_input, current_config, messages, chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
+        )
+        if updated_config is None:
+            count("ai_payments.py", "parse_failure")
+            return current_config
+        response_cache.set(cache_key, updated_config)
+        count("ai_payments.py", "api")
+        return updated_config
 
-Update the configuration based on the user input. Provide ONLY the updated JSON configuration as your response, with no additional text:
-"""
+    except CircuitOpenError:
+        count("ai_payments.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
+    except Exception as e:
+        count("ai_payments.py", "error")
+        print(f"An error occurred: {str(e)}")
+        return current_config
 
-        messages = [
-            {"role": "system", "content": "You are a specialized AI assistant for updating payment stream configurations."},
-            {"role": "user", "content": prompt}
-        ]
+@coalesce("ai_payments.py", MODEL)
+async def acreate_or_update_payment_stream(user_input: str, current_config: dict) -> dict:
+    """Async variant of create_or_update_payment_stream on the shared AsyncOpenAI client."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_payments.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
+
+    cache_key = make_key("ai_payments.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_payments.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_payments.py", "cache")
+        return cached_config
 
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages
+    try:
+        with timed("ai_payments.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        updated_config = await acomplete_update(
+            "ai_payments.py", MODEL, SCHEMA, user_input, current_config, messages, async_chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
         )
-
-        response_text = response.choices[0].message.content.strip()
-        
-        try:
-            updated_config = json.loads(response_text)
-            return updated_config
-        except json.JSONDecodeError:
-            print("Failed to update configuration. Keeping current configuration.")
+        if updated_config is None:
+            count("ai_payments.py", "parse_failure")
             return current_config
+        response_cache.set(cache_key, updated_config)
+        count("ai_payments.py", "api")
+        return updated_config
 
+    except CircuitOpenError:
+        count("ai_payments.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
     except Exception as e:
+        count("ai_payments.py", "error")
         print(f"An error occurred: {str(e)}")
         return current_config
 
-
+def stream_payment_stream_updates(user_input: str, current_config: dict):
+    """Yield validated (field, value) pairs as soon as the model finishes streaming each one."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        yield from updates.items()
+        return
+    chunks = chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, current_config))
+    yield from iter_stream_fields(chunks, PROTOCOL_FIELDS, validate_field)
+
+async def astream_payment_stream_updates(user_input: str, current_config: dict):
+    """Async iterator variant of stream_payment_stream_updates."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        for field, value in updates.items():
+            yield field, value
+        return
+    chunks = async_chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, current_config))
+    async for field, value in aiter_stream_fields(chunks, PROTOCOL_FIELDS, validate_field):
+        yield field, value
 
 def evaluate_interaction(user_input: str, config: dict) -> float:
     """Evaluate the quality of the interaction."""
@@ -97,47 +227,14 @@ def evaluate_interaction(user_input: str, config: dict) -> float:
         return 0.7
 
 def store_interaction(user_input, config, score):
-    """Store the interaction for future fine-tuning."""
-    interaction = {
-        "messages": [
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": json.dumps(config)}
-        ],
-        "score": score
-    }
-    with open("training_data_streams.jsonl", "a") as f:
-        f.write(json.dumps(interaction) + "\n")
+    """Store the interaction for future fine-tuning unless a near-duplicate is already stored."""
+    with timed("ai_payments.py", "persistence"):
+        if not seen_before("ai_payments.py", user_input, config):
+            get_store().append("ai_payments.py", user_input, config, score)
 
 def fine_tune_model():
-    """Fine-tune the model using stored interactions."""
-    with open("training_data_streams.jsonl", "r") as f:
-        interactions = [json.loads(line) for line in f]
-
-    high_quality_interactions = [
-        interaction for interaction in interactions if interaction.get('score', 0) > 0.5
-    ]
-
-    if len(high_quality_interactions) < 10:
-        logging.info("Not enough high-quality data for fine-tuning.")
-        return
-
-    with open("filtered_training_data_streams.jsonl", "w") as f:
-        for interaction in high_quality_interactions:
-            f.write(json.dumps(interaction) + "\n")
-
-    response = client.files.create(
-        file=open("filtered_training_data_streams.jsonl", "rb"),
-        purpose="fine-tune"
-    )
-    training_file_id = response.id
-
-    fine_tune_response = client.fine_tuning.jobs.create(
-        training_file=training_file_id,
-        model="gpt-3.5-turbo",
-        hyperparameters={"n_epochs": 3}
-    )
-
-    logging.info(f"Fine-tuning job created: {fine_tune_response}")
+    """Fine-tune the model on high-quality interactions logged since the last run."""
+    fine_tune("ai_payments.py", MODEL, get_client())
 
 def handle_user_input(current_config, is_first_input):
     """Handle user input and update the configuration accordingly."""
@@ -160,20 +257,7 @@ def handle_user_input(current_config, is_first_input):
     return updated_config, None
 
 if __name__ == '__main__':
-    current_config = {
-        "Asset Type": "Not defined",
-        "Payer": "Creator",
-        "Input Payment Frequency": "Not defined",
-        "Input Payment Amount": "Not defined",
-        "Output Payment Distribution": "Not defined",
-        "Distribution Frequency": "Not defined",
-        "Distribute to": "Not defined",
-        "Pause Payments": "Not defined",
-        "Pause Payments by": "Not defined",
-        "Admin": "Creator",
-        "Managers": "Not defined",
-        "Manager Permissions": "Not defined"
-    }
+    current_config = copy.deepcopy(DEFAULT_CONFIG)
 
     while True:
         user_input = input("Enter changes you want to make (or 'done' to finish): ")
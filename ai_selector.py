@@ -1,12 +1,43 @@
 import os
 import json
 import logging
-from openai import OpenAI
 
-logging.basicConfig(level=logging.INFO, filename='protocol.log', filemode='w',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from api_client import async_chat_completion, chat_completion
+from classifier import KeywordClassifier, load_traffic
+from config_delta import compact_json, parse_delta
+from metrics import count, record_usage, timed
+from resilience import CircuitOpenError
+import schema_registry
+from single_flight import coalesce
+from startup import compile_template, run_once
+from structured_logging import attach_log_file, log_event
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+LOG_FILE = 'protocol.log'
+logger = logging.getLogger("ai_selector")
+
+MODEL = "gpt-3.5-turbo"
+
+VALID_PROTOCOLS = ["ai_payments.py", "ai_vaults.py", "ai_tokentool.py"]
+
+# Inputs the local classifier scores at or above this confidence skip the LLM call.
+# One single-word keyword of one protocol scores 1 - e^-ln(4) = 0.75, and two
+# such keywords or one two-word phrase score 0.94. The default sits between
+# them, so a lone keyword ("rent", "storage") always goes to the LLM.
+CONFIDENCE_THRESHOLD = float(os.environ.get("SELECTOR_CONFIDENCE_THRESHOLD", "0.85"))
+
+# Opt-in: answer a new conversation with one completion that picks the target and extracts its config.
+FUSED = os.environ.get("SELECTOR_FUSED", "0") == "1"
+FUSED_MODEL = os.environ.get("SELECTOR_FUSED_MODEL", MODEL)
+
+PROTOCOL_PURPOSES = {
+    "ai_payments.py": "Payment streams: recurring payments, dividends, payouts, salaries, rent, subscriptions.",
+    "ai_vaults.py": "Token vaults: secure asset storage, access control, lockup periods, early withdrawal penalties.",
+    "ai_tokentool.py": "Token creation: minting, token metadata and documents, compliance such as freezing and whitelists.",
+}
+
+_classifier = None
+_render_prompt = None
+_render_fused_prompt = None
 
 PROMPT_TEMPLATE = """
 You are an advanced AI assistant specializing in protocol classification for financial and digital asset management tasks. Your role is to accurately determine the most appropriate protocol based on user input. Analyze the input carefully and select the best-matching protocol from the options below.
@@ -51,37 +82,229 @@ Where <protocol_name> is one of: ai_payments.py, ai_vaults.py, or ai_tokentool.p
 Do not include any explanations, additional text, or formatting outside of this JSON structure.
 """
 
-def determine_protocol(user_input: str) -> str:
+@run_once
+def init():
+    """Attach the module's log file, compile the prompt and build the classifier.
+
+    Runs on first use, or call it at startup.
+    """
+    global _render_prompt
+    attach_log_file(logger, LOG_FILE)
+    _render_prompt = compile_template(PROMPT_TEMPLATE)
+    get_classifier()
+
+FUSED_PROMPT_TEMPLATE = """
+Classify the user's request into one of the protocols below and extract the initial configuration for it.
+
+Protocols, with the fields and options of their configurations:
+{protocols}
+
+User Input: {user_input}
+
+Respond ONLY with a JSON object of the form {{"Target": "<protocol_name>", "Config": {{"<field>": "<value>"}}}}.
+"Config" holds only the fields the input determines, using the listed options. Fields whose only option is a placeholder such as "Not defined" take the user's value as text. When the user writes "my", "me", "I" or "myself", they mean the "Creator". Do not include any explanations or additional text.
+"""
+
+def get_classifier():
+    """Build the keyword classifier on first use from the prompt keywords and logged traffic."""
+    global _classifier
+    if _classifier is None:
+        _classifier = KeywordClassifier.from_template(PROMPT_TEMPLATE, traffic=load_traffic())
+    return _classifier
+
+def classify_locally(user_input: str, confidence_threshold: float = None):
+    """Return the selector JSON if the local classifier is confident enough, else None."""
+    threshold = CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+    target, confidence = get_classifier().classify(user_input)
+    if target is None or confidence < threshold:
+        return None
+    log_event(logger, "Classified protocol", user_input=user_input, target=target, source="local",
+              confidence=round(confidence, 2))
+    return json.dumps({"Target": target, "Prompt": user_input}, indent=2)
+
+def build_messages(user_input: str) -> list:
+    """Build the chat messages for an LLM classification."""
+    init()
+    return [
+        {"role": "system", "content": "You are a protocol classifier."},
+        {"role": "user", "content": _render_prompt(user_input=user_input)}
+    ]
+
+def parse_response(user_input: str, response_text: str) -> str:
+    """Validate the classifier output and return it as the selector JSON."""
+    api_response = json.loads(response_text)
+
+    if "Target" not in api_response or "Prompt" not in api_response:
+        raise ValueError("Invalid response structure from API")
+
+    if api_response["Target"] not in VALID_PROTOCOLS:
+        raise ValueError(f"Invalid protocol: {api_response['Target']}")
+
+    log_event(logger, "Classified protocol", user_input=user_input, target=api_response["Target"], source="api")
+
+    return json.dumps(api_response, indent=2)
+
+@coalesce("ai_selector.py", MODEL)
+def determine_protocol(user_input: str, confidence_threshold: float = None) -> str:
+    init()
+    with timed("ai_selector.py", "classification"):
+        local_result = classify_locally(user_input, confidence_threshold)
+    if local_result is not None:
+        count("ai_selector.py", "local")
+        return local_result
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a protocol classifier."},
-                {"role": "user", "content": PROMPT_TEMPLATE.format(user_input=user_input)}
-            ]
-        )
-        
-        api_response = json.loads(response.choices[0].message.content.strip())
-        
-        if "Target" not in api_response or "Prompt" not in api_response:
-            raise ValueError("Invalid response structure from API")
-        
-        valid_protocols = ["ai_payments.py", "ai_vaults.py", "ai_tokentool.py"]
-        if api_response["Target"] not in valid_protocols:
-            raise ValueError(f"Invalid protocol: {api_response['Target']}")
-        
-        logging.info(f"User Input: {user_input}")
-        logging.info(f"Classified Protocol: {api_response['Target']}")
-        
-        return json.dumps(api_response, indent=2)
+        with timed("ai_selector.py", "prompt_build"):
+            messages = build_messages(user_input)
+        with timed("ai_selector.py", "api_call"):
+            response = chat_completion(model=MODEL, messages=messages)
+        record_usage("ai_selector.py", MODEL, response)
+        with timed("ai_selector.py", "parse"):
+            result = parse_response(user_input, response.choices[0].message.content.strip())
+        count("ai_selector.py", "api")
+        return result
     
+    except CircuitOpenError:
+        # Trust the local classifier at any confidence while the API is refusing calls.
+        count("ai_selector.py", "circuit_open")
+        local_result = classify_locally(user_input, 0.0)
+        return local_result or json.dumps({"error": "Protocol selection is temporarily unavailable"})
+    except json.JSONDecodeError as e:
+        count("ai_selector.py", "parse_failure")
+        logger.error(f"JSON Decode Error: {str(e)}")
+        return json.dumps({"error": "Invalid JSON response from API"})
+    except Exception as e:
+        count("ai_selector.py", "error")
+        logger.error(f"Error: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+@coalesce("ai_selector.py", MODEL)
+async def adetermine_protocol(user_input: str, confidence_threshold: float = None) -> str:
+    """Async variant of determine_protocol on the shared AsyncOpenAI client."""
+    init()
+    with timed("ai_selector.py", "classification"):
+        local_result = classify_locally(user_input, confidence_threshold)
+    if local_result is not None:
+        count("ai_selector.py", "local")
+        return local_result
+
+    try:
+        with timed("ai_selector.py", "prompt_build"):
+            messages = build_messages(user_input)
+        with timed("ai_selector.py", "api_call"):
+            response = await async_chat_completion(model=MODEL, messages=messages)
+        record_usage("ai_selector.py", MODEL, response)
+        with timed("ai_selector.py", "parse"):
+            result = parse_response(user_input, response.choices[0].message.content.strip())
+        count("ai_selector.py", "api")
+        return result
+
+    except CircuitOpenError:
+        # Trust the local classifier at any confidence while the API is refusing calls.
+        count("ai_selector.py", "circuit_open")
+        local_result = classify_locally(user_input, 0.0)
+        return local_result or json.dumps({"error": "Protocol selection is temporarily unavailable"})
     except json.JSONDecodeError as e:
-        logging.error(f"JSON Decode Error: {str(e)}")
+        count("ai_selector.py", "parse_failure")
+        logger.error(f"JSON Decode Error: {str(e)}")
         return json.dumps({"error": "Invalid JSON response from API"})
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        count("ai_selector.py", "error")
+        logger.error(f"Error: {str(e)}")
         return json.dumps({"error": str(e)})
 
+def build_fused_messages(user_input: str) -> list:
+    """Build the chat messages for a combined classification and extraction."""
+    global _render_fused_prompt
+    if _render_fused_prompt is None:
+        # Built on first use: the protocol schemas are registered when their modules are imported.
+        protocols = {protocol: {"purpose": PROTOCOL_PURPOSES[protocol],
+                                "fields": schema_registry.get_schema(protocol).protocol_fields}
+                     for protocol in VALID_PROTOCOLS}
+        _render_fused_prompt = compile_template(FUSED_PROMPT_TEMPLATE, protocols=compact_json(protocols))
+    return [
+        {"role": "system", "content": "You are a protocol classifier and configuration extractor."},
+        {"role": "user", "content": _render_fused_prompt(user_input=user_input)}
+    ]
+
+def parse_fused_response(response_text: str):
+    """Return (target, config delta), or None unless the output names a protocol and valid fields only."""
+    result = parse_delta(response_text)
+    if result is None:
+        return None
+    target, delta = result.get("Target"), result.get("Config", {})
+    if target not in VALID_PROTOCOLS or not isinstance(delta, dict):
+        return None
+    errors = schema_registry.get_schema(target).check_delta(delta)
+    if errors:
+        logger.error(f"Fused output for {target} has invalid fields: {errors}")
+        return None
+    return target, delta
+
+def _fused_applies(user_input: str, confidence_threshold: float = None) -> bool:
+    # A confident local classification makes the selector free, so the fused call would save nothing.
+    threshold = CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+    with timed("ai_selector.py", "classification"):
+        target, confidence = get_classifier().classify(user_input)
+    return target is None or confidence < threshold
+
+@coalesce("ai_selector.py/fused", FUSED_MODEL)
+def classify_and_extract(user_input: str, confidence_threshold: float = None):
+    """Pick the target and extract its initial config delta in one completion.
+
+    Returns (target, delta), or None when the two-step path should be used:
+    the local classifier is confident, the output does not match the target's
+    schema, or the call failed.
+    """
+    init()
+    if not _fused_applies(user_input, confidence_threshold):
+        return None
+    try:
+        with timed("ai_selector.py", "prompt_build"):
+            messages = build_fused_messages(user_input)
+        with timed("ai_selector.py", "api_call"):
+            response = chat_completion(model=FUSED_MODEL, messages=messages)
+        record_usage("ai_selector.py", FUSED_MODEL, response)
+        with timed("ai_selector.py", "parse"):
+            result = parse_fused_response(response.choices[0].message.content.strip())
+    except CircuitOpenError:
+        count("ai_selector.py", "circuit_open")
+        return None
+    except Exception as e:
+        count("ai_selector.py", "error")
+        logger.error(f"Error: {str(e)}")
+        return None
+    count("ai_selector.py", "fused" if result is not None else "fused_mismatch")
+    if result is not None:
+        log_event(logger, "Classified protocol", user_input=user_input, target=result[0], source="fused")
+    return result
+
+@coalesce("ai_selector.py/fused", FUSED_MODEL)
+async def aclassify_and_extract(user_input: str, confidence_threshold: float = None):
+    """Async variant of classify_and_extract on the shared AsyncOpenAI client."""
+    init()
+    if not _fused_applies(user_input, confidence_threshold):
+        return None
+    try:
+        with timed("ai_selector.py", "prompt_build"):
+            messages = build_fused_messages(user_input)
+        with timed("ai_selector.py", "api_call"):
+            response = await async_chat_completion(model=FUSED_MODEL, messages=messages)
+        record_usage("ai_selector.py", FUSED_MODEL, response)
+        with timed("ai_selector.py", "parse"):
+            result = parse_fused_response(response.choices[0].message.content.strip())
+    except CircuitOpenError:
+        count("ai_selector.py", "circuit_open")
+        return None
+    except Exception as e:
+        count("ai_selector.py", "error")
+        logger.error(f"Error: {str(e)}")
+        return None
+    count("ai_selector.py", "fused" if result is not None else "fused_mismatch")
+    if result is not None:
+        log_event(logger, "Classified protocol", user_input=user_input, target=result[0], source="fused")
+    return result
+
 def handle_user_input():
     user_input = input("Describe your task: ")
     return determine_protocol(user_input)
@@ -1,11 +1,31 @@
-import os
-from openai import OpenAI, APIConnectionError, APIError, APIStatusError
+import copy
 import json
 import logging
+import os
 
-logging.basicConfig(level=logging.INFO, filename='token_tool.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
-
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from api_client import (
+    async_chat_completion, async_chat_completion_stream, chat_completion, chat_completion_stream, get_client
+)
+from config_delta import apply_delta, build_delta_prompt, parse_delta
+from interaction_store import get_store
+from keyword_automaton import KeywordAutomaton
+from metrics import count, timed
+from model_tiers import acomplete_update, cache_model, complete_update, strongest_model
+from near_duplicates import seen_before
+from resilience import CircuitOpenError
+from response_cache import make_key, response_cache
+from rule_extractor import extract as extract_rules
+import schema_registry
+from single_flight import coalesce
+from startup import run_once
+from stream_parser import aiter_stream_fields, iter_stream_fields
+from structured_logging import attach_log_file
+from training_pipeline import fine_tune
+
+LOG_FILE = 'token_tool.log'
+logger = logging.getLogger("ai_tokentool")
+
+MODEL = "gpt-4o-mini"
 
 PROTOCOL_FIELDS = {
     "Token Name": ["Not defined"],
@@ -23,7 +43,7 @@ PROTOCOL_FIELDS = {
     "LinkedData": ["True", "False"],
     "LinkedDataIndex": ["1", "2", "3", "4", "5", "6", "7", "8", "9"],
     "LinkedDataType": ["Document", "Text Field", "Link", "Not provided"],
-    "NumberofLinkedDataTokens": "Not defined",
+    "NumberofLinkedDataTokens": ["Not defined"],
     "LinkedDataName": ["Not defined"],
     "LinkedDataPoint": ["Not defined"],
     "PreferenceSignature": ["True", "False"],
@@ -38,107 +58,318 @@ PROTOCOL_FIELDS = {
     "TokenOwner": ["Creator", "Wallet Address", "Not defined"]
 }
 
+DEFAULT_CONFIG = {
+    "Token Name": "Not defined",
+    "Token Symbol": "Not defined",
+    "Number of Tokens": "Not defined",
+    "Asset Type": "Not defined",
+    "Description": "No description",
+    "UnifiedData": "False",
+    "UnifiedDataIndex": [],
+    "UnifiedDataType": [],
+    "UnifiedDataName": [],
+    "UnifiedDataPoint": [],
+    "CanMint": "False",
+    "MaxCap": "Not defined",
+    "LinkedData": "False",
+    "LinkedDataIndex": "1",
+    "LinkedDataType": "Not provided",
+    "NumberofLinkedDataTokens": "Not defined",
+    "LinkedDataName": "Not defined",
+    "LinkedDataPoint": "Not defined",
+    "PreferenceSignature": "False",
+    "PauseTokens": "False",
+    "ForceTransfer": "False",
+    "Freeze": "False",
+    "Blacklist": "False",
+    "TokenFee": "False",
+    "FeeEarnedBy": "Not defined",
+    "Whitelist": "False",
+    "Whitelist Admin": "Not defined",
+    "TokenOwner": "Creator"
+}
+
+SCHEMA = schema_registry.register(
+    "ai_tokentool.py", PROTOCOL_FIELDS,
+    field_types={
+        "UnifiedDataIndex": "index_list",
+        "UnifiedDataType": "enum_list",
+        "UnifiedDataName": "text_list",
+        "UnifiedDataPoint": "text_list",
+    },
+    defaults=DEFAULT_CONFIG
+)
+
+# Phrases in the input that change the config before the model is asked. A "document" adds a
+# UnifiedData entry, "set" assigns fields, "unless" lists phrases that cancel the trigger, and
+# "documents": "LinkedData" sends the matched documents to the LinkedData fields instead.
+# TOKEN_TRIGGERS_PATH can name a JSON file with a list of further triggers in the same format.
+INPUT_TRIGGERS = [
+    {"phrases": ["room plans"], "document": ["Room Plans", "https://www.example.urls/to/insert"]},
+    {"phrases": ["investment contract"], "document": ["Investment Contract", "https://www.example.urls/to/insert/two"]},
+    {"phrases": ["legal rights"], "document": ["Legal Rights", "https://example.com/rights"]},
+    {"phrases": ["linked to"], "unless": ["all tokens"], "set": {"LinkedData": "True"}, "documents": "LinkedData"},
+    {"phrases": ["integrated compliance"],
+     "set": {"PauseTokens": "True", "ForceTransfer": "True", "Freeze": "True", "Blacklist": "True"}},
+]
+
+TRIGGERS_PATH = os.environ.get("TOKEN_TRIGGERS_PATH")
+# A trigger phrase also matches when its last word takes one of these endings, e.g. "investment contracts".
+TRIGGER_SUFFIXES = ("s", "es")
+
+# The schema allows UnifiedDataIndex values 1 to 9.
+MAX_UNIFIED_DATA = len(PROTOCOL_FIELDS["UnifiedDataIndex"])
+
+_triggers = None
+
+def load_triggers() -> list:
+    triggers = list(INPUT_TRIGGERS)
+    if TRIGGERS_PATH:
+        with open(TRIGGERS_PATH, "r") as f:
+            triggers.extend(json.load(f))
+    return triggers
+
+def compile_triggers(triggers: list):
+    """Build one automaton over the phrases of every trigger and the phrases that cancel them."""
+    phrases = {}
+    for number, trigger in enumerate(triggers):
+        for phrase in trigger["phrases"]:
+            phrases.setdefault(phrase.lower(), []).append((number, True))
+        for phrase in trigger.get("unless", []):
+            phrases.setdefault(phrase.lower(), []).append((number, False))
+    return KeywordAutomaton(phrases), triggers
+
+@run_once
+def init():
+    """Attach the module's log file and compile the input triggers.
+
+    Runs on first use, or call it at startup.
+    """
+    global _triggers
+    attach_log_file(logger, LOG_FILE)
+    _triggers = compile_triggers(load_triggers())
+
 def sanitize_output(config):
     """Ensure that the output configuration strictly adheres to the predefined format."""
     sanitized_config = {}
     for key in PROTOCOL_FIELDS:
         if key in config:
-            if isinstance(PROTOCOL_FIELDS[key][0], list): 
-                sanitized_config[key] = config.get(key, [])
-            else:
-                sanitized_config[key] = config.get(key, PROTOCOL_FIELDS[key][0])
+            sanitized_config[key] = sanitize_field(key, config[key])
         else:
-            sanitized_config[key] = PROTOCOL_FIELDS[key][0]
+            sanitized_config[key] = copy.deepcopy(DEFAULT_CONFIG[key])
     return sanitized_config
 
-def update_unified_data(user_input: str, current_config: dict):
-    """Update Unified Data by adding a new document to the configuration."""
-    unified_data_indices = current_config.get("UnifiedDataIndex", [])
-    unified_data_types = current_config.get("UnifiedDataType", [])
-    unified_data_names = current_config.get("UnifiedDataName", [])
-    unified_data_points = current_config.get("UnifiedDataPoint", [])
-
-    if not isinstance(unified_data_indices, list):
-        unified_data_indices = [unified_data_indices]
-    if not isinstance(unified_data_types, list):
-        unified_data_types = [unified_data_types]
-    if not isinstance(unified_data_names, list):
-        unified_data_names = [unified_data_names]
-    if not isinstance(unified_data_points, list):
-        unified_data_points = [unified_data_points]
-
-    current_index = len(unified_data_indices) + 1 
-
-    doc_name, doc_url = extract_document_info(user_input)
-
-    current_config["UnifiedData"] = "True"
-    current_config["UnifiedDataIndex"] = unified_data_indices + [str(current_index)]
-    current_config["UnifiedDataType"] = unified_data_types + ["Document"]
-    current_config["UnifiedDataName"] = unified_data_names + [doc_name]
-    current_config["UnifiedDataPoint"] = unified_data_points + [doc_url]
-
-    return current_config
-
-def extract_document_info(user_input: str):
-    """Extract document name and URL from user input."""
-    if "room plans" in user_input.lower():
-        return "Room Plans", "https://www.example.urls/to/insert"
-    elif "investment contract" in user_input.lower():
-        return "Investment Contract", "https://www.example.urls/to/insert/two"
-    elif "legal rights" in user_input.lower():
-        return "Legal Rights", "https://example.com/rights"
-    else:
-        return "Undefined Document", "https://undefined.url"
+def matched_triggers(user_input: str) -> list:
+    """Return the triggers whose phrases occur in the input and are not cancelled, in input order."""
+    init()
+    automaton, triggers = _triggers
+    matched, cancelled = {}, set()
+    for _, _, references in automaton.finditer(user_input, suffixes=TRIGGER_SUFFIXES):
+        for number, matches in references:
+            if matches:
+                matched.setdefault(number, None)
+            else:
+                cancelled.add(number)
+    return [triggers[number] for number in matched if number not in cancelled]
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, list) else [value]
+
+def add_unified_data(config: dict, documents: list):
+    """Append the documents that are not listed yet as UnifiedData entries of the config."""
+    names = _as_list(config.get("UnifiedDataName", []))
+    points = _as_list(config.get("UnifiedDataPoint", []))
+    types = _as_list(config.get("UnifiedDataType", []))
+    added = False
+    for name, url in documents:
+        if name in names or len(names) >= MAX_UNIFIED_DATA:
+            continue
+        names.append(name)
+        points.append(url)
+        types.append("Document")
+        added = True
+    if not added:
+        return
+    config["UnifiedData"] = "True"
+    config["UnifiedDataIndex"] = [str(index) for index in range(1, len(names) + 1)]
+    config["UnifiedDataType"] = types
+    config["UnifiedDataName"] = names
+    config["UnifiedDataPoint"] = points
+
+def apply_input_triggers(user_input: str, current_config: dict) -> dict:
+    """Return the config with the document, linked data and compliance triggers of the input applied.
+
+    The input is scanned once; the given config is not modified.
+    """
+    triggers = matched_triggers(user_input)
+    if not triggers:
+        return current_config
+    config = copy.deepcopy(current_config)
+    documents = []
+    link_documents = False
+    for trigger in triggers:
+        config.update(trigger.get("set", {}))
+        if "document" in trigger:
+            documents.append(tuple(trigger["document"]))
+        link_documents = link_documents or trigger.get("documents") == "LinkedData"
+
+    if link_documents and documents:
+        name, url = documents[0]
+        config["LinkedDataType"] = "Document"
+        config["LinkedDataName"] = name
+        config["LinkedDataPoint"] = url
+    elif documents:
+        add_unified_data(config, documents)
+    return config
+
+def sanitize_field(key, value):
+    """Normalize a single field value returned by the model and check it against the schema."""
+    if isinstance(value, bool):
+        value = str(value)
+    return SCHEMA.validate_field(key, value)
+
+def build_messages(user_input: str, current_config: dict) -> list:
+    """Build the chat messages for a token configuration update."""
+    return [
+        {"role": "system", "content": "You are a specialized AI assistant for updating token configurations."},
+        {"role": "user", "content": build_delta_prompt(current_config, user_input)}
+    ]
 
+def parse_response(response_text: str, current_config: dict) -> dict:
+    """Apply the changed fields from the model output, or return None if there is no JSON object."""
+    with timed("ai_tokentool.py", "parse"):
+        delta = parse_delta(response_text)
+    if delta is None:
+        print("Failed to update configuration. Keeping current configuration.")
+        return None
+    with timed("ai_tokentool.py", "validation"):
+        return apply_delta(current_config, delta, PROTOCOL_FIELDS, sanitize_field)
+
+def rule_updates(user_input: str, current_config: dict):
+    """Return the validated rule-based updates if they explain the whole input, otherwise None."""
+    with timed("ai_tokentool.py", "rules"):
+        updates, explained = extract_rules("ai_tokentool.py", user_input, current_config)
+    if not explained:
+        return None
+    return {field: sanitize_field(field, value) for field, value in updates.items()}
+
+def fallback_updates(user_input: str, current_config: dict) -> dict:
+    """Apply whatever the rules recognised, for when the API is refusing calls."""
+    updates, _ = extract_rules("ai_tokentool.py", user_input, current_config)
+    return apply_delta(current_config, updates, PROTOCOL_FIELDS, sanitize_field)
+
+@coalesce("ai_tokentool.py", MODEL)
 def create_or_update_token_config(user_input: str, current_config: dict) -> dict:
-    try:
-        if "linked to" in user_input.lower() and "all tokens" not in user_input.lower():
-            current_config["LinkedData"] = "True"
-        else:
-            current_config = update_unified_data(user_input, current_config)
-
-        if "integrated compliance" in user_input.lower():
-            current_config["PauseTokens"] = "True"
-            current_config["ForceTransfer"] = "True"
-            current_config["Freeze"] = "True"
-            current_config["Blacklist"] = "True"
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_tokentool.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, sanitize_field)
+
+    cache_key = make_key("ai_tokentool.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_tokentool.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_tokentool.py", "cache")
+        return cached_config
 
-        prompt = f"""
-Given the current configuration:
-{json.dumps(current_config, indent=2)}
+    try:
+        current_config = apply_input_triggers(user_input, current_config)
 
-And the user input:
-"{user_input}"
+        with timed("ai_tokentool.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        updated_config = complete_update(
+            "ai_tokentool.py", MODEL, SCHEMA, user_input, current_config, messages, chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
+        )
+        if updated_config is None:
+            count("ai_tokentool.py", "parse_failure")
+            return current_config
+        response_cache.set(cache_key, updated_config)
+        count("ai_tokentool.py", "api")
+        return updated_config
 
-Update the configuration based on the user input. Provide ONLY the updated JSON configuration as your response, with no additional text:
-"""
+    except CircuitOpenError:
+        count("ai_tokentool.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
+    except Exception as e:
+        count("ai_tokentool.py", "error")
+        print(f"An error occurred: {str(e)}")
+        return current_config
 
-        client = OpenAI()
+@coalesce("ai_tokentool.py", MODEL)
+async def acreate_or_update_token_config(user_input: str, current_config: dict) -> dict:
+    """Async variant of create_or_update_token_config on the shared AsyncOpenAI client."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_tokentool.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, sanitize_field)
+
+    cache_key = make_key("ai_tokentool.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_tokentool.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_tokentool.py", "cache")
+        return cached_config
 
-        messages = [
-            {"role": "system", "content": "You are a specialized AI assistant for updating token configurations."},
-            {"role": "user", "content": prompt}
-        ]
+    try:
+        current_config = apply_input_triggers(user_input, current_config)
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
+        with timed("ai_tokentool.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        updated_config = await acomplete_update(
+            "ai_tokentool.py", MODEL, SCHEMA, user_input, current_config, messages, async_chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
         )
-
-        response_text = response.choices[0].message.content.strip()
-
-        try:
-            updated_config = json.loads(response_text)
-            updated_config = sanitize_output(updated_config)
-            return updated_config
-        except json.JSONDecodeError:
-            print("Failed to update configuration. Keeping current configuration.")
+        if updated_config is None:
+            count("ai_tokentool.py", "parse_failure")
             return current_config
+        response_cache.set(cache_key, updated_config)
+        count("ai_tokentool.py", "api")
+        return updated_config
 
+    except CircuitOpenError:
+        count("ai_tokentool.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
     except Exception as e:
+        count("ai_tokentool.py", "error")
         print(f"An error occurred: {str(e)}")
         return current_config
 
+def _trigger_updates(user_input: str, current_config: dict):
+    """Return the prepared config and the fields the input triggers changed in it."""
+    prepared_config = apply_input_triggers(user_input, current_config)
+    changed = [(key, value) for key, value in prepared_config.items() if current_config.get(key) != value]
+    return prepared_config, changed
+
+def stream_token_config_updates(user_input: str, current_config: dict):
+    """Yield validated (field, value) pairs as soon as the model finishes streaming each one."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        yield from updates.items()
+        return
+    prepared_config, changed = _trigger_updates(user_input, current_config)
+    yield from changed
+    chunks = chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, prepared_config))
+    yield from iter_stream_fields(chunks, PROTOCOL_FIELDS, sanitize_field)
+
+async def astream_token_config_updates(user_input: str, current_config: dict):
+    """Async iterator variant of stream_token_config_updates."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        for field, value in updates.items():
+            yield field, value
+        return
+    prepared_config, changed = _trigger_updates(user_input, current_config)
+    for field, value in changed:
+        yield field, value
+    chunks = async_chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, prepared_config))
+    async for field, value in aiter_stream_fields(chunks, PROTOCOL_FIELDS, sanitize_field):
+        yield field, value
+
 def evaluate_interaction(user_input: str, config: dict) -> float:
     """Evaluate the quality of the interaction."""
     if "adjust" in user_input.lower():
@@ -149,47 +380,14 @@ def evaluate_interaction(user_input: str, config: dict) -> float:
         return 0.7
 
 def store_interaction(user_input, config, score):
-    """Store the interaction for future fine-tuning."""
-    interaction = {
-        "messages": [
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": json.dumps(config)}
-        ],
-        "score": score
-    }
-    with open("training_data_token_tool.jsonl", "a") as f:
-        f.write(json.dumps(interaction) + "\n")
+    """Store the interaction for future fine-tuning unless a near-duplicate is already stored."""
+    with timed("ai_tokentool.py", "persistence"):
+        if not seen_before("ai_tokentool.py", user_input, config):
+            get_store().append("ai_tokentool.py", user_input, config, score)
 
 def fine_tune_model():
-    """Fine-tune the model using stored interactions."""
-    with open("training_data_token_tool.jsonl", "r") as f:
-        interactions = [json.loads(line) for line in f]
-
-    high_quality_interactions = [
-        interaction for interaction in interactions if interaction.get('score', 0) > 0.5
-    ]
-
-    if len(high_quality_interactions) < 10:
-        logging.info("Not enough high-quality data for fine-tuning.")
-        return
-
-    with open("filtered_training_data_token_tool.jsonl", "w") as f:
-        for interaction in high_quality_interactions:
-            f.write(json.dumps(interaction) + "\n")
-
-    response = client.files.create(
-        file=open("filtered_training_data_token_tool.jsonl", "rb"),
-        purpose="fine-tune"
-    )
-    training_file_id = response.id
-
-    fine_tune_response = client.fine_tuning.jobs.create(
-        training_file=training_file_id,
-        model="gpt-4o-mini",
-        hyperparameters={"n_epochs": 3}
-    )
-
-    logging.info(f"Fine-tuning job created: {fine_tune_response}")
+    """Fine-tune the model on high-quality interactions logged since the last run."""
+    fine_tune("ai_tokentool.py", MODEL, get_client())
 
 def handle_user_input(current_config):
     """Handle user input and update the configuration accordingly."""
@@ -208,36 +406,7 @@ def handle_user_input(current_config):
     return current_config, True
 
 if __name__ == '__main__':
-    current_config = {
-        "Token Name": "Not defined",
-        "Token Symbol": "Not defined",
-        "Number of Tokens": "Not defined",
-        "Asset Type": "Not defined",
-        "Description": "No description",
-        "UnifiedData": "False",
-        "UnifiedDataIndex": [],
-        "UnifiedDataType": [],
-        "UnifiedDataName": [],
-        "UnifiedDataPoint": [],
-        "CanMint": "False",
-        "MaxCap": "Not defined",
-        "LinkedData": "False",
-        "LinkedDataIndex": "1",
-        "LinkedDataType": "Not provided",
-        "NumberofLinkedDataTokens": "Not defined",
-        "LinkedDataName": "Not defined",
-        "LinkedDataPoint": "Not defined",
-        "PreferenceSignature": "False",
-        "PauseTokens": "False",
-        "ForceTransfer": "False",
-        "Freeze": "False",
-        "Blacklist": "False",
-        "TokenFee": "False",
-        "FeeEarnedBy": "Not defined",
-        "Whitelist": "False",
-        "Whitelist Admin": "Not defined",
-        "TokenOwner": "Creator"
-    }
+    current_config = copy.deepcopy(DEFAULT_CONFIG)
 
     final_config, _ = handle_user_input(current_config)
 
@@ -1,12 +1,30 @@
-import os
-from openai import OpenAI, APIConnectionError, APIError, APIStatusError
+import copy
 import json
 import logging
-import re
 
-logging.basicConfig(level=logging.INFO, filename='token_vaults.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+from api_client import (
+    api_errors, async_chat_completion, async_chat_completion_stream, chat_completion, chat_completion_stream,
+    get_client
+)
+from config_delta import apply_delta, compact_json, parse_delta
+from interaction_store import get_store
+from metrics import count, timed
+from model_tiers import acomplete_update, cache_model, complete_update, strongest_model
+from near_duplicates import seen_before
+from resilience import CircuitOpenError
+from response_cache import make_key, response_cache
+from rule_extractor import extract as extract_rules
+import schema_registry
+from single_flight import coalesce
+from startup import compile_template, run_once
+from stream_parser import aiter_stream_fields, iter_stream_fields
+from structured_logging import attach_log_file, log_payload
+from training_pipeline import fine_tune
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+LOG_FILE = 'token_vaults.log'
+logger = logging.getLogger("ai_vaults")
+
+MODEL = "gpt-3.5-turbo"
 
 PROTOCOL_FIELDS = {
     "Asset Type": ["Equity Tokens", "Real Estate", "Watches", "Vehicles", "Not defined"],
@@ -25,6 +43,30 @@ PROTOCOL_FIELDS = {
     "Manager Permissions": ["Input payments", "Change data", "Withdraw funds", "Delete payment stream", "Not defined"]
 }
 
+DEFAULT_CONFIG = {
+    "Asset Type": "Not defined",
+    "Access Control": "Not defined",
+    "Duration": "Not defined",
+    "Penalty": "Not defined",
+    "Input Payments": "Not defined",
+    "Input Payments Frequency": "Not defined",
+    "Input Payment Currency": "Not defined",
+    "Output Payment Distribution": "Not defined",
+    "Distribution Frequency": "Not defined",
+    "Distribute to": "Not defined",
+    "Vault Description": "No description",
+    "Admin": "Creator",
+    "Managers": "Not defined",
+    "Manager Permissions": "Not defined"
+}
+
+SCHEMA = schema_registry.register(
+    "ai_vaults.py", PROTOCOL_FIELDS,
+    field_types={"Duration": "duration", "Penalty": "percentage"},
+    defaults=DEFAULT_CONFIG,
+    fallback="Not defined"
+)
+
 PROMPT_TEMPLATE = """
 You are an advanced AI assistant specialized in configuring digital token vaults. Your task is to extract, analyze, and process detailed vault configurations from the user's input. The user may describe various scenarios related to asset storage, duration, penalties, payment streams, and access control. You must interpret the context and determine the appropriate parameters for the vault configuration. When the user writes "my", "me", "I", "myself", etc, he means the (=) "Creator".
 
@@ -32,81 +74,180 @@ Ensure that all data extracted corresponds to the predefined fields and options:
 
 {protocol_fields}
 
+Current configuration:
+{current_config}
+
 User's new input or requested changes:
 {user_input}
 
 Update the vault configuration based on the user's input. If a field is not mentioned or changed, keep its previous value from the current configuration. Provide ONLY ONE updated JSON-like output, strictly adhering to the predefined fields and options. Only include fields that have changed; for unchanged fields, do not include them in the output. Do not include any explanations or additional text, just the single, final JSON object with the changes:
 """
 
+_render_prompt = None
+
+@run_once
+def init():
+    """Attach the module's log file and compile the prompt. Runs on first use, or call it at startup."""
+    global _render_prompt
+    attach_log_file(logger, LOG_FILE)
+    _render_prompt = compile_template(PROMPT_TEMPLATE, protocol_fields=compact_json(PROTOCOL_FIELDS))
+
+def validate_field(field, value):
+    """Return the value if it is allowed for the field, otherwise "Not defined"."""
+    return SCHEMA.validate_field(field, value)
+
 def validate_config(config):
     """Validate and correct the configuration based on protocol fields."""
-    for field, value in config.items():
-        if field == "Duration":
-            if value != "Not defined":
-                try:
-                    months = int(value.split()[0])
-                    if months < 1 or months > 36:
-                        config[field] = "Not defined"
-                except:
-                    config[field] = "Not defined"
-        elif field == "Penalty":
-            if value != "Not defined":
-                try:
-                    penalty = float(value[:-1])
-                    if penalty < 0.01 or penalty > 10:
-                        config[field] = "Not defined"
-                except:
-                    config[field] = "Not defined"
-        elif field in PROTOCOL_FIELDS:
-            if value not in PROTOCOL_FIELDS[field]:
-                config[field] = "Not defined"
-    return config
+    return SCHEMA.validate(config)[0]
+
+def build_messages(user_input: str, current_config: dict) -> list:
+    """Build the chat messages for a token vault update."""
+    init()
+    return [
+        {"role": "system", "content": "You are a specialized AI assistant."},
+        {"role": "user", "content": _render_prompt(
+            current_config=compact_json(current_config),
+            user_input=user_input
+        )}
+    ]
+
+def parse_response(response_text: str, current_config: dict) -> dict:
+    """Apply the changed fields from the model output, validating only the touched keys."""
+    with timed("ai_vaults.py", "parse"):
+        delta = parse_delta(response_text)
+    if delta is None:
+        logger.error(f"No valid JSON found in the response: {response_text}")
+        return None
+
+    # "Not defined" in a vault delta means the model had nothing to say about the field.
+    delta = {key: value for key, value in delta.items() if value != "Not defined"}
+    with timed("ai_vaults.py", "validation"):
+        return apply_delta(current_config, delta, PROTOCOL_FIELDS, validate_field)
+
+def rule_updates(user_input: str, current_config: dict):
+    """Return the validated rule-based updates if they explain the whole input, otherwise None."""
+    with timed("ai_vaults.py", "rules"):
+        updates, explained = extract_rules("ai_vaults.py", user_input, current_config)
+    if not explained:
+        return None
+    return {field: validate_field(field, value) for field, value in updates.items()}
+
+def fallback_updates(user_input: str, current_config: dict) -> dict:
+    """Apply whatever the rules recognised, for when the API is refusing calls."""
+    updates, _ = extract_rules("ai_vaults.py", user_input, current_config)
+    return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
 
+@coalesce("ai_vaults.py", MODEL)
 def create_or_update_token_vault(user_input: str, current_config: dict) -> dict:
     """Create or update the token vault configuration based on user input."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_vaults.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
+
+    cache_key = make_key("ai_vaults.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_vaults.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_vaults.py", "cache")
+        return cached_config
+
     try:
-        messages = [
-            {"role": "system", "content": "You are a specialized AI assistant."},
-            {"role": "user", "content": PROMPT_TEMPLATE.format(
-                protocol_fields=json.dumps(PROTOCOL_FIELDS, indent=2),
-                current_config=json.dumps(current_config, indent=2),
-                user_input=user_input
-            )}
-        ]
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages
+        with timed("ai_vaults.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        validated_config = complete_update(
+            "ai_vaults.py", MODEL, SCHEMA, user_input, current_config, messages, chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
         )
+        if validated_config is None:
+            count("ai_vaults.py", "parse_failure")
+            return current_config
+        log_payload(logger, "Updated config", validated_config, user_input=user_input)
+        response_cache.set(cache_key, validated_config)
+        count("ai_vaults.py", "api")
+        return validated_config
 
-        response_text = response.choices[0].message.content.strip()
-        
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            try:
-                updated_config = json.loads(json_str)
-                for key, value in updated_config.items():
-                    if value != "Not defined":
-                        current_config[key] = value
-                validated_config = validate_config(current_config)
-                logging.info(f"User Input: {user_input}")
-                logging.info(f"Updated Config: {json.dumps(validated_config, indent=2)}")
-                return validated_config
-            except json.JSONDecodeError:
-                logging.error(f"Failed to parse extracted JSON: {json_str}")
-        else:
-            logging.error(f"No valid JSON found in the response: {response_text}")
-        
+    except CircuitOpenError:
+        count("ai_vaults.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
+    except api_errors() as e:
+        count("ai_vaults.py", "error")
+        logger.error(f"API Error: {str(e)}")
+        return current_config
+    except Exception as e:
+        count("ai_vaults.py", "error")
+        logger.error(f"Unexpected Error: {str(e)}")
         return current_config
 
-    except (APIConnectionError, APIStatusError, APIError) as e:
-        logging.error(f"API Error: {str(e)}")
+@coalesce("ai_vaults.py", MODEL)
+async def acreate_or_update_token_vault(user_input: str, current_config: dict) -> dict:
+    """Async variant of create_or_update_token_vault on the shared AsyncOpenAI client."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        count("ai_vaults.py", "rules")
+        return apply_delta(current_config, updates, PROTOCOL_FIELDS, validate_field)
+
+    cache_key = make_key("ai_vaults.py", user_input, current_config, cache_model(MODEL))
+    with timed("ai_vaults.py", "cache"):
+        cached_config = response_cache.get(cache_key)
+    if cached_config is not None:
+        count("ai_vaults.py", "cache")
+        return cached_config
+
+    try:
+        with timed("ai_vaults.py", "prompt_build"):
+            messages = build_messages(user_input, current_config)
+        validated_config = await acomplete_update(
+            "ai_vaults.py", MODEL, SCHEMA, user_input, current_config, messages, async_chat_completion,
+            lambda response_text: parse_response(response_text, current_config)
+        )
+        if validated_config is None:
+            count("ai_vaults.py", "parse_failure")
+            return current_config
+        log_payload(logger, "Updated config", validated_config, user_input=user_input)
+        response_cache.set(cache_key, validated_config)
+        count("ai_vaults.py", "api")
+        return validated_config
+
+    except CircuitOpenError:
+        count("ai_vaults.py", "circuit_open")
+        return fallback_updates(user_input, current_config)
+    except api_errors() as e:
+        count("ai_vaults.py", "error")
+        logger.error(f"API Error: {str(e)}")
         return current_config
     except Exception as e:
-        logging.error(f"Unexpected Error: {str(e)}")
+        count("ai_vaults.py", "error")
+        logger.error(f"Unexpected Error: {str(e)}")
         return current_config
 
+def stream_token_vault_updates(user_input: str, current_config: dict):
+    """Yield validated (field, value) pairs as soon as the model finishes streaming each one."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        yield from updates.items()
+        return
+    chunks = chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, current_config))
+    for field, value in iter_stream_fields(chunks, PROTOCOL_FIELDS, validate_field):
+        if value != "Not defined":
+            yield field, value
+
+async def astream_token_vault_updates(user_input: str, current_config: dict):
+    """Async iterator variant of stream_token_vault_updates."""
+    init()
+    updates = rule_updates(user_input, current_config)
+    if updates is not None:
+        for field, value in updates.items():
+            yield field, value
+        return
+    chunks = async_chat_completion_stream(model=strongest_model(MODEL), messages=build_messages(user_input, current_config))
+    async for field, value in aiter_stream_fields(chunks, PROTOCOL_FIELDS, validate_field):
+        if value != "Not defined":
+            yield field, value
+
 def evaluate_interaction(user_input: str, config: dict) -> float:
     """Evaluate the quality of the interaction."""
     if "adjust" in user_input.lower():
@@ -117,47 +258,14 @@ def evaluate_interaction(user_input: str, config: dict) -> float:
         return 0.7
 
 def store_interaction(user_input, config, score):
-    """Store the interaction for future fine-tuning."""
-    interaction = {
-        "messages": [
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": json.dumps(config)}
-        ],
-        "score": score
-    }
-    with open("training_data_vaults.jsonl", "a") as f:
-        f.write(json.dumps(interaction) + "\n")
+    """Store the interaction for future fine-tuning unless a near-duplicate is already stored."""
+    with timed("ai_vaults.py", "persistence"):
+        if not seen_before("ai_vaults.py", user_input, config):
+            get_store().append("ai_vaults.py", user_input, config, score)
 
 def fine_tune_model():
-    """Fine-tune the model using stored interactions."""
-    with open("training_data_vaults.jsonl", "r") as f:
-        interactions = [json.loads(line) for line in f]
-
-    high_quality_interactions = [
-        interaction for interaction in interactions if interaction.get('score', 0) > 0.5
-    ]
-
-    if len(high_quality_interactions) < 10:
-        logging.info("Not enough high-quality data for fine-tuning.")
-        return
-
-    with open("filtered_training_data_vaults.jsonl", "w") as f:
-        for interaction in high_quality_interactions:
-            f.write(json.dumps(interaction) + "\n")
-
-    response = client.files.create(
-        file=open("filtered_training_data_vaults.jsonl", "rb"),
-        purpose="fine-tune"
-    )
-    training_file_id = response.id
-
-    fine_tune_response = client.fine_tuning.jobs.create(
-        training_file=training_file_id,
-        model="gpt-3.5-turbo",
-        hyperparameters={"n_epochs": 3}
-    )
-
-    logging.info(f"Fine-tuning job created: {fine_tune_response}")
+    """Fine-tune the model on high-quality interactions logged since the last run."""
+    fine_tune("ai_vaults.py", MODEL, get_client())
 
 def handle_user_input(current_config, is_first_input):
     """Handle user input and update the configuration accordingly."""
@@ -180,22 +288,7 @@ def handle_user_input(current_config, is_first_input):
     return updated_config, None
 
 if __name__ == '__main__':
-    current_config = {
-        "Asset Type": "Not defined",
-        "Access Control": "Not defined",
-        "Duration": "Not defined",
-        "Penalty": "Not defined",
-        "Input Payments": "Not defined",
-        "Input Payments Frequency": "Not defined",
-        "Input Payment Currency": "Not defined",
-        "Output Payment Distribution": "Not defined",
-        "Distribution Frequency": "Not defined",
-        "Distribute to": "Not defined",
-        "Vault Description": "No description",
-        "Admin": "Creator",
-        "Managers": "Not defined",
-        "Manager Permissions": "Not defined"
-    }
+    current_config = copy.deepcopy(DEFAULT_CONFIG)
     is_successful = None
     is_first_input = True
 
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import resilience
+
+# Connection pool and timeout settings shared by the sync and async clients.
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]").
+CLIENT_SETTINGS = {
+    "max_connections": int(os.environ.get("OPENAI_POOL_SIZE", "100")),
+    "max_keepalive_connections": int(os.environ.get("OPENAI_KEEPALIVE_CONNECTIONS", "20")),
+    "keepalive_expiry": float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30")),
+    "timeout": float(os.environ.get("OPENAI_TIMEOUT", "60")),
+    "connect_timeout": float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5")),
+    "http2": os.environ.get("OPENAI_HTTP2", "0") == "1",
+    # Retries are done by resilience.py within the call deadline, so the SDK's own are off by default.
+    "max_retries": int(os.environ.get("OPENAI_MAX_RETRIES", "0")),
+    # None keeps the SDK default (OPENAI_BASE_URL or api.openai.com); point it at mock_openai.py to run offline.
+    "base_url": os.environ.get("OPENAI_BASE_URL"),
+}
+
+# Maximum number of API calls the async engines keep in flight per event loop.
+ASYNC_CONCURRENCY_LIMIT = int(os.environ.get("OPENAI_CONCURRENCY_LIMIT", "100"))
+
+_client = None
+# An injected async client; when None each event loop gets its own.
+_async_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+# The openai and httpx packages are imported when the first client is built, which keeps
+# importing the protocol modules cheap.
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=CLIENT_SETTINGS["max_connections"],
+        max_keepalive_connections=CLIENT_SETTINGS["max_keepalive_connections"],
+        keepalive_expiry=CLIENT_SETTINGS["keepalive_expiry"],
+    )
+
+
+def _timeout():
+    import httpx
+    return httpx.Timeout(CLIENT_SETTINGS["timeout"], connect=CLIENT_SETTINGS["connect_timeout"])
+
+
+def configure(**settings):
+    """Override CLIENT_SETTINGS; clients created afterwards use the new values."""
+    unknown = set(settings) - set(CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+    with _lock:
+        CLIENT_SETTINGS.update(settings)
+    reset_clients()
+
+
+def get_client():
+    """Return the pooled OpenAI client shared by every protocol module and thread."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from openai import DefaultHttpxClient, OpenAI
+                _client = OpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    base_url=CLIENT_SETTINGS["base_url"],
+                    max_retries=CLIENT_SETTINGS["max_retries"],
+                    http_client=DefaultHttpxClient(
+                        limits=_limits(), timeout=_timeout(), http2=CLIENT_SETTINGS["http2"]
+                    ),
+                )
+    return _client
+
+
+def get_async_client():
+    """Return the AsyncOpenAI client shared by every protocol module on the running event loop.
+
+    Its connection pool is bound to the loop it was first used on, so each
+    loop gets its own client, the same way each gets its own semaphore.
+    """
+    if _async_client is not None:
+        return _async_client
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                client = AsyncOpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    base_url=CLIENT_SETTINGS["base_url"],
+                    max_retries=CLIENT_SETTINGS["max_retries"],
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=_limits(), timeout=_timeout(), http2=CLIENT_SETTINGS["http2"]
+                    ),
+                )
+                _async_clients[loop] = client
+    return client
+
+
+def api_errors():
+    """The openai exception types for an except clause, imported only once one is being matched."""
+    from openai import APIConnectionError, APIError, APIStatusError
+    return APIConnectionError, APIStatusError, APIError
+
+
+def set_client(client):
+    """Inject the sync client, e.g. a fake in tests or one pointed at another base_url."""
+    global _client
+    with _lock:
+        _client = client
+
+
+def set_async_client(client):
+    """Inject the async client used on every event loop, e.g. a fake in tests; None restores per-loop clients."""
+    global _async_client
+    with _lock:
+        _async_client = client
+
+
+def reset_clients():
+    """Drop the shared clients so the next call builds them from the current settings."""
+    global _client, _async_client
+    with _lock:
+        _client = None
+        _async_client = None
+        _async_clients.clear()
+
+
+def set_concurrency_limit(limit: int):
+    """Change the number of concurrent async API calls; applies to new event loops."""
+    global ASYNC_CONCURRENCY_LIMIT
+    if limit < 1:
+        raise ValueError("Concurrency limit must be at least 1")
+    ASYNC_CONCURRENCY_LIMIT = limit
+    _semaphores.clear()
+
+
+def _get_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY_LIMIT)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+def _create(**kwargs):
+    return get_client().chat.completions.create(**kwargs)
+
+
+def _acreate(**kwargs):
+    return get_async_client().chat.completions.create(**kwargs)
+
+
+def chat_completion(deadline: float = None, **kwargs):
+    """Run chat.completions.create on the shared pooled client.
+
+    The call is bounded by `deadline` seconds (resilience.DEADLINE by default),
+    retried on transient errors and refused while the model's circuit is open.
+    """
+    return resilience.call(_create, kwargs["model"], deadline, **kwargs)
+
+
+async def async_chat_completion(deadline: float = None, **kwargs):
+    """Run chat.completions.create on the shared async client within the concurrency limit."""
+    async with _get_semaphore():
+        return await resilience.acall(_acreate, kwargs["model"], deadline, **kwargs)
+
+
+def chat_completion_stream(deadline: float = None, **kwargs):
+    """Yield the text deltas of a streamed chat completion on the shared pooled client."""
+    for chunk in resilience.open_stream(_create, kwargs["model"], deadline, stream=True, **kwargs):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def async_chat_completion_stream(deadline: float = None, **kwargs):
+    """Async variant of chat_completion_stream; holds a concurrency slot until the stream ends."""
+    async with _get_semaphore():
+        stream = await resilience.aopen_stream(_acreate, kwargs["model"], deadline, stream=True, **kwargs)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -1,40 +1,95 @@
+function appendOutput(html) {
+    document.getElementById('chat-output').innerHTML += html;
+}
+
+function newSessionId() {
+    return (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+// One id per conversation, so the pipeline continues the conversation's config.
+let sessionId = newSessionId();
+// Aborts the pipeline request that is still streaming, if any.
+let inFlight = null;
+
+function renderMessage(line) {
+    if (!line.trim()) {
+        return;
+    }
+    const message = JSON.parse(line);
+    if (message.selector) {
+        appendOutput(`<div>Selector: ${JSON.stringify(message.selector)}</div>`);
+    } else if (message.target) {
+        appendOutput(`<div>Response: ${JSON.stringify(message.target)}</div>`);
+    } else if (message.error) {
+        appendOutput(`<div>Error: ${message.error}</div>`);
+    }
+}
+
+// Render each NDJSON line of the pipeline stream as soon as it arrives.
+async function readPipeline(response) {
+    if (!response.ok) {
+        const text = await response.text();
+        let error = text || response.statusText;
+        try {
+            error = JSON.parse(text).error || error;
+        } catch (e) {
+            // Not a JSON error body; show it as it is.
+        }
+        throw new Error(`${response.status} ${error}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(renderMessage);
+    }
+    // The last line may not end with a newline.
+    renderMessage(buffer + decoder.decode());
+}
+
 document.getElementById('send-btn').addEventListener('click', () => {
     const userInput = document.getElementById('user-input').value;
-    document.getElementById('chat-output').innerHTML += `<div>User: ${userInput}</div>`;
-    fetch('/api/selector', {
+    appendOutput(`<div>User: ${userInput}</div>`);
+    const controller = new AbortController();
+    inFlight = controller;
+    fetch('/api/pipeline?stream=1', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ user_input: userInput })
-    })
-    .then(response => response.json())
-    .then(selectorResponse => {
-        document.getElementById('chat-output').innerHTML += `<div>Selector: ${JSON.stringify(selectorResponse)}</div>`;
-        return fetch('/api/target', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ target: selectorResponse.Target, prompt: selectorResponse.Prompt })
-        });
-    })
-    .then(response => response.json())
-    .then(targetResponse => {
-        document.getElementById('chat-output').innerHTML += `<div>Response: ${JSON.stringify(targetResponse)}</div>`;
+        body: JSON.stringify({ user_input: userInput, session_id: sessionId }),
+        signal: controller.signal
     })
+    .then(readPipeline)
     .catch(error => {
-        document.getElementById('chat-output').innerHTML += `<div>Error: ${error}</div>`;
+        if (error.name !== 'AbortError') {
+            appendOutput(`<div>Error: ${error}</div>`);
+        }
+    })
+    .finally(() => {
+        if (inFlight === controller) {
+            inFlight = null;
+        }
     });
 });
 
+// Stop is handled here only: sending "quit" to a protocol would be a paid
+// model call whose answer is saved into the session.
 document.getElementById('stop-btn').addEventListener('click', () => {
-    document.getElementById('chat-output').innerHTML += `<div>Command: Stop</div>`;
-    fetch('/api/target', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ prompt: 'quit' })
-    });
+    appendOutput(`<div>Command: Stop</div>`);
+    if (inFlight) {
+        inFlight.abort();
+        inFlight = null;
+    }
+    // The next message starts a new conversation.
+    sessionId = newSessionId();
 });
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+from api_client import set_concurrency_limit
+from pipeline import arun_pipeline, init_protocols
+import structured_logging
+
+LOG_FILE = "batch_runner.log"
+logger = logging.getLogger("batch_runner")
+
+# Fields looked up, in order, for the prompt text of an input record.
+PROMPT_FIELDS = ["user_input", "prompt", "body"]
+
+CHECKPOINT_EVERY = 100
+
+
+def read_records(path: str, skip: set, start: int):
+    """Yield (index, line) for every JSONL line at or after start that is not in skip.
+
+    Lines are parsed by the workers so a malformed one only fails its own record.
+    Blank lines yield None so the ordered writer does not wait for them.
+    """
+    with open(path, "r") as f:
+        for index, line in enumerate(f):
+            if index < start or index in skip:
+                continue
+            yield index, line if line.strip() else None
+
+
+def written_indexes(path: str, start: int) -> set:
+    """Return the indexes at or after start that an earlier run already wrote to the output."""
+    indexes = set()
+    if not os.path.exists(path):
+        return indexes
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                index = json.loads(line)["index"]
+            except (ValueError, TypeError, KeyError):
+                # A line cut short by a crash.
+                continue
+            if index >= start:
+                indexes.add(index)
+    return indexes
+
+
+def record_prompt(record: dict, prompt_field: str = None) -> str:
+    """Return the prompt text of an input record."""
+    if prompt_field:
+        return record[prompt_field]
+    for field in PROMPT_FIELDS:
+        if field in record:
+            return record[field]
+    raise KeyError(f"Record has none of the prompt fields {PROMPT_FIELDS}")
+
+
+async def process_record(index: int, line: str, prompt_field: str = None) -> dict:
+    """Parse one JSONL line and run it through the selector and the chosen protocol's update function."""
+    result = {"index": index, "id": None}
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError(f"Record is a JSON {type(record).__name__}, not an object")
+        result["id"] = record.get("id", record.get("request_id"))
+        outcome = await arun_pipeline(record_prompt(record, prompt_field), record.get("config"))
+        selection = outcome["selector"]
+        if "error" in selection:
+            result["error"] = selection["error"]
+            return result
+
+        result["target"] = selection["Target"]
+        result["config"] = outcome["target"]
+    except Exception as e:
+        logger.error(f"Batch record {index} failed: {str(e)}")
+        result["error"] = str(e)
+    return result
+
+
+def load_checkpoint(path: str) -> dict:
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {"completed": 0, "done": []}
+
+
+def save_checkpoint(path: str, completed: int, done: set):
+    """Atomically persist the contiguous watermark and any completed records past it."""
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"completed": completed, "done": sorted(done)}, f)
+    os.replace(tmp_path, path)
+
+
+async def run_batch(input_path: str, output_path: str, workers: int = 16, ordered: bool = True,
+                    checkpoint_path: str = None, prompt_field: str = None):
+    """Stream a JSONL file of prompts through the pipeline with a bounded worker pool."""
+    checkpoint = load_checkpoint(checkpoint_path)
+    completed = checkpoint["completed"]
+    done = set(checkpoint["done"])
+    if checkpoint_path:
+        # Results written after the last checkpoint must not be appended a second time.
+        done |= written_indexes(output_path, completed)
+
+    queue = asyncio.Queue(maxsize=workers * 2)
+    results = asyncio.Queue()
+
+    async def producer():
+        for item in read_records(input_path, done, completed):
+            await queue.put(item)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, line = item
+            if line is None:
+                await results.put({"index": index, "skipped": True})
+            else:
+                await results.put(await process_record(index, line, prompt_field))
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(worker()) for _ in range(workers)]
+
+    async def close_results():
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await results.put(None)
+
+    closer = asyncio.create_task(close_results())
+    pending = {}
+    since_checkpoint = 0
+
+    with open(output_path, "a" if completed or done else "w") as out:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+
+            if ordered:
+                pending[result["index"]] = result
+                ready = []
+                while completed in pending or completed in done:
+                    if completed in pending:
+                        ready.append(pending.pop(completed))
+                    done.discard(completed)
+                    completed += 1
+            else:
+                ready = [result]
+                done.add(result["index"])
+                while completed in done:
+                    done.discard(completed)
+                    completed += 1
+
+            ready = [item for item in ready if not item.get("skipped")]
+            for item in ready:
+                out.write(json.dumps(item) + "\n")
+            since_checkpoint += len(ready)
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                out.flush()
+                save_checkpoint(checkpoint_path, completed, done)
+                since_checkpoint = 0
+
+    await closer
+    save_checkpoint(checkpoint_path, completed, done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the selector and protocol engines.")
+    parser.add_argument("input", help="JSONL file with one prompt record per line")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--workers", type=int, default=16, help="number of records processed concurrently")
+    parser.add_argument("--completion-order", action="store_true", help="write results as they finish instead of in input order")
+    parser.add_argument("--checkpoint", help="checkpoint file used to resume an interrupted run")
+    parser.add_argument("--prompt-field", help="record field holding the prompt text")
+    parser.add_argument("--concurrency-limit", type=int, help="maximum number of concurrent API calls")
+    args = parser.parse_args()
+
+    if args.concurrency_limit:
+        set_concurrency_limit(args.concurrency_limit)
+    structured_logging.attach_log_file(logger, LOG_FILE)
+    init_protocols()
+
+    asyncio.run(run_batch(
+        args.input, args.output,
+        workers=args.workers,
+        ordered=not args.completion_order,
+        checkpoint_path=args.checkpoint,
+        prompt_field=args.prompt_field
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import ai_selector
+import api_client
+import gateway
+import mock_openai
+import pipeline
+import server
+import worker
+from response_cache import response_cache
+
+ENGINES = {"payments": "ai_payments.py", "vaults": "ai_vaults.py", "tokentool": "ai_tokentool.py"}
+SERVER_ROUTES = ["server-pipeline", "server-selector", "server-target"]
+SCENARIOS = ["selector"] + list(ENGINES) + ["pipeline"] + SERVER_ROUTES
+PROTOCOL_MODULES = ["ai_payments", "ai_vaults", "ai_tokentool", "ai_selector"]
+
+# Run in a fresh interpreter: times the imports and reports what they left behind.
+STARTUP_PROBE = """
+import json, logging, sys, time
+start = time.perf_counter()
+import {modules}
+seconds = time.perf_counter() - start
+import api_client
+print(json.dumps({{
+    "seconds": seconds,
+    "openai_imported": "openai" in sys.modules,
+    "client_created": api_client._client is not None or len(api_client._async_clients) > 0,
+    "root_log_handlers": len(logging.getLogger().handlers),
+}}))
+"""
+
+# Prompts that need the model: none of them is fully explained by the rule extractor.
+DEFAULT_INPUTS = {
+    "selector": [
+        "I want to set up monthly dividend payouts for my real estate investors",
+        "Create a vault that locks our funds for a year with a small early withdrawal penalty",
+        "Mint 1000 tokens named Rental Income Token and keep a whitelist",
+        "Distribute rental income to every token holder each quarter",
+        "I need a safe place for company savings that only admins can open",
+    ],
+    "ai_payments.py": [
+        "Set up monthly salary payments of EUR 2500 managed by the HR team",
+        "Investors should receive their dividends every quarter, paid by the creator",
+        "Let whitelisted addresses pause the payments when something goes wrong",
+    ],
+    "ai_vaults.py": [
+        "Lock the vault for 12 months and charge a 2% penalty for leaving early",
+        "Only admins and managers should be able to access the vault for our watches",
+        "Deposits come in weekly in euros and payouts go to all token holders",
+    ],
+    "ai_tokentool.py": [
+        "Create 5000 real estate tokens called Rental Income Token with symbol RIT",
+        "The tokens should be mintable up to a max cap of 1 million and support force transfers",
+        "Link the title deed document to the tokens and let the creator earn the fees",
+    ],
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(outcomes, wall_seconds):
+    """Turn (latency, ok) pairs into the report; ok is None when the call raised."""
+    latencies = sorted(latency * 1000 for latency, _ in outcomes)
+    failures = sum(ok is False for _, ok in outcomes)
+    errors = sum(ok is None for _, ok in outcomes)
+    return {
+        "requests": len(outcomes),
+        "failures": failures,
+        "errors": errors,
+        "failure_rate": (failures + errors) / len(outcomes) if outcomes else 0.0,
+        "throughput_rps": len(outcomes) / wall_seconds if wall_seconds else None,
+        "wall_seconds": wall_seconds,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def run_threads(call, inputs, total, concurrency):
+    def one(i):
+        start = time.perf_counter()
+        try:
+            ok = bool(call(inputs[i % len(inputs)]))
+        except Exception as e:
+            logging.error(f"Benchmark call failed: {str(e)}")
+            ok = None
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(total)))
+    return summarize(outcomes, time.perf_counter() - start)
+
+
+def run_async(call, inputs, total, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = bool(await call(inputs[i % len(inputs)]))
+                except Exception as e:
+                    logging.error(f"Benchmark call failed: {str(e)}")
+                    ok = None
+                return time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(i) for i in range(total)))
+        return summarize(outcomes, time.perf_counter() - start)
+
+    return asyncio.run(main())
+
+
+def selector_call(confidence_threshold, asynchronous):
+    if asynchronous:
+        async def call(text):
+            return "error" not in json.loads(await ai_selector.adetermine_protocol(text, confidence_threshold))
+    else:
+        def call(text):
+            return "error" not in json.loads(ai_selector.determine_protocol(text, confidence_threshold))
+    return call
+
+
+def engine_call(target, asynchronous):
+    # The engines hand back the config they were given, or a coalesced copy of it,
+    # when no update could be parsed, so success is a result that differs from it.
+    if asynchronous:
+        update = pipeline.ASYNC_TARGETS[target]
+
+        async def call(text):
+            config = pipeline.starting_config(target)
+            return await update(text, config) != config
+    else:
+        update = pipeline.TARGETS[target][0]
+
+        def call(text):
+            config = pipeline.starting_config(target)
+            return update(text, config) != config
+    return call
+
+
+def pipeline_call(asynchronous):
+    # Counts as a success when a target was chosen and its config was updated.
+    def succeeded(result):
+        selection, updated = result.get("selector", {}), result.get("target")
+        return "Target" in selection and updated != pipeline.TARGETS[selection["Target"]][1]
+
+    if asynchronous:
+        async def call(text):
+            return succeeded(await pipeline.arun_pipeline(text))
+    else:
+        def call(text):
+            return succeeded(pipeline.run_pipeline(text))
+    return call
+
+
+def start_servers():
+    """Run worker.py and server.py on ephemeral ports; return (server url, stop)."""
+    backend = worker.ProtocolServer(("127.0.0.1", 0), worker.ProtocolRequestHandler)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    gateway.BACKEND_URL = f"http://127.0.0.1:{backend.server_address[1]}"
+    frontend = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=frontend.serve_forever, daemon=True).start()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    def stop():
+        frontend.shutdown()
+        backend.shutdown()
+
+    return f"http://127.0.0.1:{frontend.server_port}", stop
+
+
+def server_call(route, base_url, concurrency, target="ai_vaults.py"):
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+
+    def call(text):
+        if route == "server-selector":
+            body = session.post(f"{base_url}/api/selector", json={"user_input": text}).json()
+            return "Target" in body
+        if route == "server-target":
+            body = session.post(f"{base_url}/api/target", json={"target": target, "prompt": text}).json()
+            return "error" not in body and body != pipeline.TARGETS[target][1]
+        body = session.post(f"{base_url}/api/pipeline", json={"user_input": text}).json()
+        selection, updated = body.get("selector", {}), body.get("target")
+        return "Target" in selection and updated != pipeline.TARGETS[selection["Target"]][1]
+    return call
+
+
+def measure_startup(modules=PROTOCOL_MODULES, runs=5):
+    """Import the modules in fresh interpreters; report the import time and any side effects."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")])))
+    probe = STARTUP_PROBE.format(modules=", ".join(modules))
+    samples, side_effects = [], set()
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cwd:
+            output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                                    cwd=cwd, env=env).stdout
+            created = os.listdir(cwd)
+        result = json.loads(output)
+        samples.append(result.pop("seconds") * 1000)
+        side_effects.update(name for name, value in result.items() if value)
+        side_effects.update(f"created {name}" for name in created)
+    return {
+        "commit": git_commit(),
+        "modules": modules,
+        "runs": runs,
+        "import_ms": {"median": statistics.median(samples), "max": max(samples)},
+        "side_effects": sorted(side_effects),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scenarios, total=200, concurrency=16, latency="fixed:0.05", malformed_rate=0.0,
+                  error_rate=0.0, asynchronous=False, use_cache=False, confidence_threshold=None, inputs=None,
+                  fused=False):
+    """Run each scenario against a local mock of the OpenAI API and return the JSON report."""
+    inputs = dict(DEFAULT_INPUTS, **(inputs or {}))
+    if not use_cache:
+        response_cache.max_entries = 0
+        response_cache.disk = None
+    if confidence_threshold is not None:
+        ai_selector.CONFIDENCE_THRESHOLD = confidence_threshold
+    ai_selector.FUSED = fused
+    mock = mock_openai.MockOpenAI(latency, malformed_rate=malformed_rate, error_rate=error_rate)
+    base_url, stop_mock = mock_openai.start_in_thread(mock)
+    api_client.configure(base_url=base_url, max_retries=0, max_connections=max(concurrency, 10))
+    stop_servers = None
+    runner = run_async if asynchronous else run_threads
+
+    report = {
+        "commit": git_commit(),
+        "settings": {"requests": total, "concurrency": concurrency, "latency": latency,
+                     "malformed_rate": malformed_rate, "error_rate": error_rate, "async": asynchronous,
+                     "cache": use_cache, "confidence_threshold": confidence_threshold, "fused": fused},
+        "scenarios": {},
+    }
+    try:
+        for scenario in scenarios:
+            api_calls = mock.stats["requests"]
+            if scenario == "selector":
+                result = runner(selector_call(confidence_threshold, asynchronous), inputs["selector"],
+                                total, concurrency)
+            elif scenario in ENGINES:
+                target = ENGINES[scenario]
+                result = runner(engine_call(target, asynchronous), inputs[target], total, concurrency)
+            elif scenario == "pipeline":
+                result = runner(pipeline_call(asynchronous), inputs["selector"], total, concurrency)
+            else:
+                if stop_servers is None:
+                    server_url, stop_servers = start_servers()
+                route_inputs = inputs["ai_vaults.py"] if scenario == "server-target" else inputs["selector"]
+                result = run_threads(server_call(scenario, server_url, concurrency), route_inputs,
+                                     total, concurrency)
+            result["api_calls"] = mock.stats["requests"] - api_calls
+            report["scenarios"][scenario] = result
+    finally:
+        if stop_servers is not None:
+            stop_servers()
+        stop_mock()
+    return report
+
+
+def write_report(report, path=None):
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the selector, engines and server routes offline.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", default="fixed:0.05",
+                        help="mock API latency, e.g. fixed:0.05, uniform:0.02:0.2, lognormal:-2.3:0.5")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of mock replies that are not JSON")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock requests that fail with 500")
+    parser.add_argument("--async", dest="asynchronous", action="store_true",
+                        help="drive the async selector and engines instead of threads")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--confidence-threshold", type=float,
+                        help="local classifier threshold; above 1 every selection goes to the API")
+    parser.add_argument("--fused", action="store_true",
+                        help="classify and extract new conversations in one call in the pipeline scenarios")
+    parser.add_argument("--inputs", help="JSON file mapping 'selector' or a protocol to a list of prompts")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure importing the protocol modules instead of running scenarios")
+    parser.add_argument("--startup-budget-ms", type=float, default=250.0,
+                        help="with --startup, exit with status 1 above this median import time or on side effects")
+    args = parser.parse_args()
+
+    if args.startup:
+        report = measure_startup()
+        write_report(report, args.output)
+        if report["import_ms"]["median"] > args.startup_budget_ms or report["side_effects"]:
+            sys.exit(1)
+        return
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    inputs = None
+    if args.inputs:
+        with open(args.inputs, "r") as f:
+            inputs = json.load(f)
+
+    report = run_benchmark(
+        scenarios, total=args.requests, concurrency=args.concurrency, latency=args.latency,
+        malformed_rate=args.malformed_rate, error_rate=args.error_rate, asynchronous=args.asynchronous,
+        use_cache=args.cache, confidence_threshold=args.confidence_threshold, inputs=inputs,
+        fused=args.fused
+    )
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import math
+import os
+import re
+from collections import defaultdict
+
+from interaction_store import get_store
+
+PROTOCOLS = ["ai_payments.py", "ai_vaults.py", "ai_tokentool.py"]
+
+# Keywords that are not spelled out in the selector prompt but show up in
+# almost every request for the given protocol.
+EXTRA_KEYWORDS = {
+    "ai_payments.py": ["payments", "payment", "salary", "salaries", "rent", "subscription",
+                       "payer", "distribution frequency", "preferred shares", "recurring"],
+    "ai_vaults.py": ["vault", "vaults", "lock-up", "lock up", "lockup", "withdrawal penalty",
+                     "early withdrawal", "maturity", "savings", "storage"],
+    "ai_tokentool.py": ["create tokens", "tokens named", "tokens called", "symbol", "max cap",
+                        "force transfer", "blacklist", "minted", "mint", "linked to"],
+}
+
+STOPWORDS = frozenset([
+    "a", "an", "the", "and", "or", "of", "to", "for", "with", "in", "on", "my", "me", "i",
+    "it", "is", "be", "by", "at", "as", "this", "that", "should", "can", "will", "want",
+    "create", "set", "up", "make", "new", "please", "all",
+])
+
+KEYWORD_WEIGHT = 1.0
+TRAFFIC_WEIGHT = 0.25
+TRAFFIC_MIN_COUNT = 3
+TRAFFIC_MIN_PURITY = 0.8
+# Only the newest logged inputs per protocol are read when the index is built.
+TRAFFIC_SAMPLE = int(os.environ.get("CLASSIFIER_TRAFFIC_SAMPLE", "5000"))
+MAX_NGRAM = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+
+def tokenize(text: str):
+    """Split text into lowercase word tokens."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def ngrams(tokens, max_n=MAX_NGRAM):
+    """Yield every 1..max_n gram of the token list as a space-joined string."""
+    for n in range(1, max_n + 1):
+        for i in range(len(tokens) - n + 1):
+            yield " ".join(tokens[i:i + n])
+
+
+def parse_keywords(template: str) -> dict:
+    """Extract the 'Typical keywords' list of each protocol from the selector prompt."""
+    keywords = {}
+    current = None
+    for line in template.splitlines():
+        stripped = line.strip().lstrip("•").strip()
+        if stripped.rstrip(":") in PROTOCOLS:
+            current = stripped.rstrip(":")
+        elif current and stripped.startswith("- Typical keywords:"):
+            values = stripped.split(":", 1)[1]
+            keywords[current] = [k.strip() for k in values.split(",") if k.strip()]
+    return keywords
+
+
+def load_traffic(store=None, limit=TRAFFIC_SAMPLE):
+    """Read the newest `limit` logged user inputs per protocol from the interaction store."""
+    store = get_store() if store is None else store
+    traffic = {}
+    for protocol in PROTOCOLS:
+        for interaction in store.recent(limit, protocol=protocol):
+            for message in interaction.get("messages", []):
+                if message.get("role") == "user":
+                    traffic.setdefault(protocol, []).append(message.get("content", ""))
+    return traffic
+
+
+class KeywordClassifier:
+    """Weighted n-gram index mapping user input to a protocol with a confidence score."""
+
+    def __init__(self, keywords: dict, traffic: dict = None):
+        self.index = {}
+        self._build(keywords, traffic or {})
+
+    @classmethod
+    def from_template(cls, template: str, traffic: dict = None):
+        keywords = parse_keywords(template)
+        for protocol, extra in EXTRA_KEYWORDS.items():
+            keywords.setdefault(protocol, [])
+            keywords[protocol] = keywords[protocol] + extra
+        return cls(keywords, traffic)
+
+    def _build(self, keywords, traffic):
+        raw = defaultdict(lambda: defaultdict(float))
+        for protocol, phrases in keywords.items():
+            for phrase in phrases:
+                tokens = tokenize(phrase)
+                if tokens:
+                    # Longer phrases are more specific than single words.
+                    raw[" ".join(tokens)][protocol] += KEYWORD_WEIGHT * len(tokens)
+
+        counts = defaultdict(lambda: defaultdict(int))
+        for protocol, samples in traffic.items():
+            for sample in samples:
+                for gram in set(ngrams(tokenize(sample))):
+                    if gram not in STOPWORDS:
+                        counts[gram][protocol] += 1
+        for gram, per_protocol in counts.items():
+            total = sum(per_protocol.values())
+            protocol, count = max(per_protocol.items(), key=lambda item: item[1])
+            if count >= TRAFFIC_MIN_COUNT and count / total >= TRAFFIC_MIN_PURITY:
+                raw[gram][protocol] += TRAFFIC_WEIGHT * math.log1p(count) * len(gram.split())
+
+        # Terms shared by several protocols carry less signal.
+        n_protocols = len(PROTOCOLS)
+        for gram, per_protocol in raw.items():
+            idf = math.log(1 + n_protocols / len(per_protocol))
+            self.index[gram] = {protocol: weight * idf for protocol, weight in per_protocol.items()}
+
+    def scores(self, user_input: str) -> dict:
+        """Return the summed index weight of every protocol for the input."""
+        totals = dict.fromkeys(PROTOCOLS, 0.0)
+        for gram in ngrams(tokenize(user_input)):
+            entry = self.index.get(gram)
+            if entry:
+                for protocol, weight in entry.items():
+                    totals[protocol] += weight
+        return totals
+
+    def classify(self, user_input: str):
+        """Return (protocol, confidence); protocol is None when nothing matched."""
+        totals = self.scores(user_input)
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        best, best_score = ranked[0]
+        if best_score <= 0:
+            return None, 0.0
+        share = best_score / sum(totals.values())
+        evidence = 1 - math.exp(-best_score)
+        return best, share * evidence
@@ -0,0 +1,52 @@
+import copy
+import json
+import re
+
+DELTA_INSTRUCTIONS = (
+    "Respond ONLY with a JSON object containing the fields whose values change. "
+    "Omit every unchanged field and respond with {} if nothing changes. "
+    "Do not include any explanations or additional text."
+)
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def compact_json(value) -> str:
+    """Serialize without indentation or padding to keep prompts short."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def build_delta_prompt(current_config: dict, user_input: str, schema: dict = None) -> str:
+    """Build an update prompt that asks the model for the changed fields only."""
+    parts = []
+    if schema is not None:
+        parts.append(f"Allowed fields and options:\n{compact_json(schema)}")
+    parts.append(f"Current configuration:\n{compact_json(current_config)}")
+    parts.append(f'User input:\n"{user_input}"')
+    parts.append(DELTA_INSTRUCTIONS)
+    return "\n\n".join(parts)
+
+
+def parse_delta(response_text: str):
+    """Extract the JSON object of changed fields from the model output, or None."""
+    match = _JSON_OBJECT_RE.search(response_text)
+    if not match:
+        return None
+    try:
+        delta = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return delta if isinstance(delta, dict) else None
+
+
+def apply_delta(current_config: dict, delta: dict, fields, validate_field) -> dict:
+    """Return a copy of current_config with the delta applied.
+
+    Keys outside `fields` are ignored and only the touched keys are passed
+    through `validate_field(key, value)`.
+    """
+    updated_config = copy.deepcopy(current_config)
+    for key, value in delta.items():
+        if key in fields:
+            updated_config[key] = validate_field(key, value)
+    return updated_config
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+import metrics
+import structured_logging
+from pipeline import STREAM_TARGETS, aiter_pipeline, init_protocols, save_session, session_config
+
+LOG_FILE = "gateway.log"
+logger = logging.getLogger("gateway")
+
+BACKEND_URL = os.environ.get("PROTOCOL_BACKEND_URL", "http://localhost:8001")
+
+# Upstream timeout per route, in seconds.
+ROUTE_TIMEOUTS = {
+    "selector": float(os.environ.get("GATEWAY_SELECTOR_TIMEOUT", "15")),
+    "target": float(os.environ.get("GATEWAY_TARGET_TIMEOUT", "60")),
+    "pipeline": float(os.environ.get("GATEWAY_PIPELINE_TIMEOUT", "75")),
+}
+
+# Requests allowed upstream at once, and how many more may wait before we answer 503.
+MAX_IN_FLIGHT = int(os.environ.get("GATEWAY_MAX_IN_FLIGHT", "64"))
+MAX_QUEUED = int(os.environ.get("GATEWAY_MAX_QUEUED", "256"))
+UPSTREAM_POOL_SIZE = int(os.environ.get("GATEWAY_POOL_SIZE", "100"))
+
+
+class Backpressure:
+    """Bounded admission: MAX_IN_FLIGHT run, MAX_QUEUED wait, everything else is rejected."""
+
+    def __init__(self, max_in_flight: int, max_queued: int):
+        self.max_queued = max_queued
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.waiting = 0
+
+    def full(self) -> bool:
+        return self.semaphore.locked() and self.waiting >= self.max_queued
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+async def forward(request: web.Request, route: str, path: str, payload: dict) -> web.Response:
+    """POST payload to the backend within the route's timeout and the admission limits."""
+    backpressure = request.app["backpressure"]
+    if backpressure.full():
+        return web.json_response({"error": "Server busy, try again later"}, status=503)
+
+    async with backpressure:
+        try:
+            async with request.app["session"].post(
+                f"{BACKEND_URL}{path}",
+                json=payload,
+                timeout=ClientTimeout(total=ROUTE_TIMEOUTS[route])
+            ) as response:
+                return web.json_response(await response.json(content_type=None), status=response.status)
+        except asyncio.TimeoutError:
+            logger.error(f"Upstream timeout on {path}")
+            return web.json_response({"error": "Upstream timeout"}, status=504)
+        except (ClientError, ValueError) as e:
+            logger.error(f"Upstream error on {path}: {str(e)}")
+            return web.json_response({"error": str(e)}, status=502)
+
+
+async def selector(request: web.Request) -> web.Response:
+    data = await request.json()
+    return await forward(request, "selector", "/selector", {"user_input": data["user_input"]})
+
+
+async def target(request: web.Request) -> web.Response:
+    data = await request.json()
+    if not data.get("target"):
+        return web.json_response({"error": "Missing target"}, status=400)
+    payload = {"user_input": data["prompt"], "session_id": data.get("session_id")}
+    return await forward(request, "target", f'/{data["target"]}', payload)
+
+
+async def pipeline(request: web.Request) -> web.Response:
+    """Run selection and the target update in-process and answer with both results."""
+    data = await request.json()
+    backpressure = request.app["backpressure"]
+    if backpressure.full():
+        return web.json_response({"error": "Server busy, try again later"}, status=503)
+
+    stream = request.query.get("stream") == "1"
+    results = {}
+    response = None
+
+    async def relay():
+        nonlocal response
+        async for stage, result in aiter_pipeline(data["user_input"], data.get("config"), data.get("session_id")):
+            if not stream:
+                results[stage] = result
+                continue
+            if response is None:
+                response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+                await response.prepare(request)
+            await response.write((json.dumps({stage: result}) + "\n").encode("utf-8"))
+
+    async with backpressure:
+        try:
+            # wait_for rather than asyncio.timeout, which needs Python 3.11.
+            await asyncio.wait_for(relay(), ROUTE_TIMEOUTS["pipeline"])
+        except asyncio.TimeoutError:
+            logger.error("Pipeline timeout")
+            if response is None:
+                return web.json_response({"error": "Pipeline timeout"}, status=504)
+            await response.write((json.dumps({"error": "Pipeline timeout"}) + "\n").encode("utf-8"))
+
+    if response is not None:
+        await response.write_eof()
+        return response
+    return web.json_response(results)
+
+
+async def target_stream(request: web.Request) -> web.StreamResponse:
+    """Relay each config field as a server-sent event as soon as the model completes it."""
+    data = await request.json()
+    stream_updates = STREAM_TARGETS.get(data.get("target"))
+    if stream_updates is None:
+        return web.json_response({"error": "Missing or unknown target"}, status=400)
+    backpressure = request.app["backpressure"]
+    if backpressure.full():
+        return web.json_response({"error": "Server busy, try again later"}, status=503)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    config = session_config(data["target"], data.get("config"), data.get("session_id"))
+
+    async def relay():
+        async for field, value in stream_updates(data["prompt"], config):
+            config[field] = value
+            event = json.dumps({"field": field, "value": value})
+            await response.write(f"event: field\ndata: {event}\n\n".encode("utf-8"))
+
+    async with backpressure:
+        try:
+            await asyncio.wait_for(relay(), ROUTE_TIMEOUTS["target"])
+            save_session(data.get("session_id"), data["target"], config)
+            await response.write(f"event: done\ndata: {json.dumps(config)}\n\n".encode("utf-8"))
+        except Exception as e:
+            logger.error(f"Target stream error: {str(e)}")
+            await response.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+@web.middleware
+async def observe_request(request: web.Request, handler):
+    """Record the handling time of every request by route and status."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unknown"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, "gateway", route, str(status))
+
+
+async def on_startup(app: web.Application):
+    app["session"] = ClientSession(connector=TCPConnector(limit=UPSTREAM_POOL_SIZE, keepalive_timeout=30))
+    app["backpressure"] = Backpressure(MAX_IN_FLIGHT, MAX_QUEUED)
+
+
+async def on_cleanup(app: web.Application):
+    await app["session"].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[observe_request])
+    app.router.add_post('/api/selector', selector)
+    app.router.add_post('/api/target', target)
+    app.router.add_post('/api/pipeline', pipeline)
+    app.router.add_post('/api/target/stream', target_stream)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main(port: int = 8000):
+    structured_logging.attach_log_file(logger, LOG_FILE)
+    init_protocols()
+    web.run_app(create_app(), port=port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import atexit
+import glob
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: lock with msvcrt instead.
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+STORE_DIR = os.environ.get("INTERACTION_STORE_DIR", "interactions")
+SEGMENT_BYTES = int(os.environ.get("INTERACTION_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+FLUSH_RECORDS = int(os.environ.get("INTERACTION_FLUSH_RECORDS", "32"))
+FLUSH_INTERVAL = float(os.environ.get("INTERACTION_FLUSH_INTERVAL", "5"))
+# "always" fsyncs every flush, "interval" at most once per FSYNC_INTERVAL, "never" leaves it to the OS.
+FSYNC_POLICY = os.environ.get("INTERACTION_FSYNC", "interval")
+FSYNC_INTERVAL = float(os.environ.get("INTERACTION_FSYNC_INTERVAL", "1"))
+
+PROTOCOL_IDS = {"ai_payments.py": 0, "ai_vaults.py": 1, "ai_tokentool.py": 2}
+PROTOCOL_NAMES = {value: key for key, value in PROTOCOL_IDS.items()}
+
+# One index entry per record: byte offset, byte length, timestamp, score, protocol id.
+INDEX_ENTRY = struct.Struct("<QIdfB")
+
+
+def _lock_file(f):
+    """Take an exclusive lock on an open file, waiting for other processes to release it."""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after ten one-second retries.
+                continue
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class InteractionStore:
+    """Append-only interaction log split into size-bounded segments with a sidecar index.
+
+    Records are buffered in memory and written in batches under an exclusive
+    file lock, so several processes can share one store directory. A partial
+    batch is written by a timer flush_interval seconds after its first record.
+    """
+
+    def __init__(self, directory=STORE_DIR, segment_bytes=SEGMENT_BYTES, flush_records=FLUSH_RECORDS,
+                 flush_interval=FLUSH_INTERVAL, fsync_policy=FSYNC_POLICY):
+        if fsync_policy not in ("always", "interval", "never"):
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_fsync = 0.0
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def append(self, protocol: str, user_input: str, config: dict, score: float, timestamp: float = None):
+        """Buffer one scored interaction; it is written once the batch is full or old enough."""
+        timestamp = time.time() if timestamp is None else timestamp
+        interaction = {
+            "messages": [
+                {"role": "user", "content": user_input},
+                {"role": "assistant", "content": json.dumps(config)}
+            ],
+            "score": score,
+            "protocol": protocol,
+            "timestamp": timestamp,
+        }
+        line = (json.dumps(interaction) + "\n").encode("utf-8")
+        with self._buffer_lock:
+            self._buffer.append((PROTOCOL_IDS[protocol], timestamp, score, line))
+            due = (len(self._buffer) >= self.flush_records
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+            first = len(self._buffer) == 1
+        if due:
+            self.flush()
+        elif first:
+            # Without it a quiet process would hold the batch until the next append.
+            timer = threading.Timer(self.flush_interval, self.flush)
+            timer.daemon = True
+            timer.start()
+
+    def flush(self):
+        """Write all buffered records to the active segment and its index."""
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if not batch:
+                return
+
+            payload = b"".join(line for _, _, _, line in batch)
+            with open(os.path.join(self.directory, ".lock"), "a+") as lock_file:
+                _lock_file(lock_file)
+                try:
+                    data_path = self._active_segment(len(payload))
+                    with open(data_path, "ab") as data, open(data_path[:-len(".jsonl")] + ".idx", "ab") as index:
+                        offset = data.tell()
+                        entries = []
+                        for protocol_id, timestamp, score, line in batch:
+                            entries.append(INDEX_ENTRY.pack(offset, len(line), timestamp, score, protocol_id))
+                            offset += len(line)
+                        data.write(payload)
+                        data.flush()
+                        index.write(b"".join(entries))
+                        index.flush()
+                        if self._should_fsync():
+                            os.fsync(data.fileno())
+                            os.fsync(index.fileno())
+                finally:
+                    _unlock_file(lock_file)
+
+    def _should_fsync(self):
+        if self.fsync_policy == "always":
+            return True
+        if self.fsync_policy == "interval" and time.monotonic() - self._last_fsync >= FSYNC_INTERVAL:
+            self._last_fsync = time.monotonic()
+            return True
+        return False
+
+    def _active_segment(self, incoming: int) -> str:
+        """Return the segment to append to, starting a new one when the current one is full."""
+        segments = self.segments()
+        if segments:
+            current = segments[-1]
+            size = os.path.getsize(current)
+            if size == 0 or size + incoming <= self.segment_bytes:
+                return current
+            number = self.segment_number(current) + 1
+        else:
+            number = 1
+        return os.path.join(self.directory, f"segment-{number:06d}.jsonl")
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, "segment-*.jsonl")))
+
+    def index_entries(self, segment: str):
+        """Yield (offset, length, timestamp, score, protocol) for every complete index entry."""
+        index_path = segment[:-len(".jsonl")] + ".idx"
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for offset, length, timestamp, score, protocol_id in INDEX_ENTRY.iter_unpack(data[:usable]):
+            yield offset, length, timestamp, score, PROTOCOL_NAMES.get(protocol_id)
+
+    def scan(self, protocol: str = None, score_above: float = None, since: float = None, until: float = None):
+        """Yield stored interactions matching the filters, reading only the matching lines."""
+        for segment in self.segments():
+            matches = [
+                (offset, length)
+                for offset, length, timestamp, score, entry_protocol in self.index_entries(segment)
+                if (protocol is None or entry_protocol == protocol)
+                and (score_above is None or score > score_above)
+                and (since is None or timestamp >= since)
+                and (until is None or timestamp < until)
+            ]
+            if not matches:
+                continue
+            with open(segment, "rb") as f:
+                for offset, length in matches:
+                    f.seek(offset)
+                    yield json.loads(f.read(length))
+
+    @staticmethod
+    def segment_number(segment: str) -> int:
+        return int(os.path.basename(segment)[len("segment-"):-len(".jsonl")])
+
+    def end_cursor(self):
+        """Return (segment number, entries) just past the last fully indexed record."""
+        segments = self.segments()
+        if not segments:
+            return 0, 0
+        last = segments[-1]
+        index_path = last[:-len(".jsonl")] + ".idx"
+        size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        return self.segment_number(last), size // INDEX_ENTRY.size
+
+    def read_range(self, start=(0, 0), end=None, protocol: str = None, score_above: float = None):
+        """Yield the matching interactions between two cursors, oldest first.
+
+        A cursor is (segment number, index entries consumed in that segment);
+        older segments are never written again once a newer one exists.
+        """
+        end = self.end_cursor() if end is None else end
+        for segment in self.segments():
+            number = self.segment_number(segment)
+            if number < start[0] or number > end[0]:
+                continue
+            first = start[1] if number == start[0] else 0
+            last = end[1] if number == end[0] else None
+            entries = list(self.index_entries(segment))[first:last]
+            matches = [
+                (offset, length) for offset, length, _, score, entry_protocol in entries
+                if (protocol is None or entry_protocol == protocol)
+                and (score_above is None or score > score_above)
+            ]
+            if not matches:
+                continue
+            with open(segment, "rb") as f:
+                for offset, length in matches:
+                    f.seek(offset)
+                    yield json.loads(f.read(length))
+
+    def recent(self, limit: int, protocol: str = None):
+        """Yield up to limit of the newest interactions, optionally of one protocol, newest first."""
+        for segment in reversed(self.segments()):
+            if limit <= 0:
+                return
+            matches = [
+                (offset, length) for offset, length, _, _, entry_protocol in self.index_entries(segment)
+                if protocol is None or entry_protocol == protocol
+            ][-limit:]
+            limit -= len(matches)
+            if not matches:
+                continue
+            with open(segment, "rb") as f:
+                for offset, length in reversed(matches):
+                    f.seek(offset)
+                    yield json.loads(f.read(length))
+
+    def import_jsonl(self, path: str, protocol: str):
+        """Copy a legacy training_data_*.jsonl file into the store."""
+        with open(path, "r") as f:
+            for line in f:
+                interaction = json.loads(line)
+                messages = interaction.get("messages", [])
+                if len(messages) < 2:
+                    continue
+                self.append(protocol, messages[0]["content"], json.loads(messages[1]["content"]),
+                            interaction.get("score", 0))
+        self.flush()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide interaction store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = InteractionStore()
+    return _store
+
+
+def shutdown():
+    """Write out the buffered records of the process-wide store, for processes that skip atexit."""
+    if _store is not None:
+        _store.flush()
@@ -0,0 +1,84 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a fixed phrase dictionary.
+
+    Finds every occurrence of every phrase in one pass over the text, so the
+    cost of a lookup grows with the length of the input rather than with the
+    number of phrases.
+    """
+
+    def __init__(self, phrases: dict):
+        # phrases: phrase -> value reported for each of its matches.
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for phrase, value in phrases.items():
+            self._insert(phrase.lower(), value)
+        self._link()
+
+    def __len__(self):
+        return len(self._goto)
+
+    def _insert(self, phrase, value):
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(phrase), value))
+
+    def _link(self):
+        """Set the failure links breadth-first and merge the outputs of each state's suffixes."""
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def finditer(self, text: str, whole_words: bool = True, suffixes=()):
+        """Yield (start, end, value) for every match, ordered by where the phrase ends.
+
+        With whole_words, matches that start or end inside a word are skipped,
+        except that the word may go on with one of `suffixes` (e.g. a plural
+        "s"); end then includes the suffix.
+        """
+        text = text.lower()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                start = end - length
+                if not whole_words:
+                    yield start, end, value
+                    continue
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                word_end = self._word_end(text, end, suffixes)
+                if word_end is not None:
+                    yield start, word_end, value
+
+    @staticmethod
+    def _word_end(text, end, suffixes):
+        """Return where the word ending at `end`, or at one of its suffixes, stops; None inside a word."""
+        if end == len(text) or not text[end].isalnum():
+            return end
+        for suffix in suffixes:
+            stop = end + len(suffix)
+            if text.startswith(suffix, end) and (stop == len(text) or not text[stop].isalnum()):
+                return stop
+        return None
@@ -0,0 +1,120 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from in-process stages up to slow completions.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {count}"
+
+
+STAGE_SECONDS = Histogram(
+    "protocol_stage_seconds", "Time spent in each processing stage.", ("protocol", "stage"))
+REQUESTS = Counter(
+    "protocol_requests_total", "Update and selection requests by how they were answered.", ("protocol", "outcome"))
+TOKENS = Counter(
+    "protocol_tokens_total", "Tokens reported by the API usage field.", ("protocol", "model", "kind"))
+RESILIENCE = Counter(
+    "api_resilience_events_total", "Retries, hedged requests, deadline and open-circuit refusals.", ("model", "event"))
+TIER_SECONDS = Histogram(
+    "model_tier_seconds", "API call time of each model tier attempt.", ("protocol", "model", "route"))
+TIER_RESULTS = Counter(
+    "model_tier_results_total", "Model tier attempts by whether their output was accepted.",
+    ("protocol", "model", "route", "result"))
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request handling time.", ("server", "route", "status"))
+
+
+@contextmanager
+def timed(protocol: str, stage: str):
+    """Record the duration of the enclosed block as one stage observation."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, protocol, stage)
+
+
+def count(protocol: str, outcome: str):
+    REQUESTS.inc(protocol, outcome)
+
+
+def record_usage(protocol: str, model: str, response):
+    """Add the prompt and completion token counts of a completion, if it reports them."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    TOKENS.inc(protocol, model, "prompt", amount=usage.prompt_tokens or 0)
+    TOKENS.inc(protocol, model, "completion", amount=usage.completion_tokens or 0)
+
+
+def render() -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for metric in _registry for line in metric.render()]
+    return "\n".join(lines) + "\n"
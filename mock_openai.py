@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+
+from aiohttp import web
+
+# Canned replies per protocol: the selector answers with a target, the engines with a config delta.
+CANNED_RESPONSES = {
+    "ai_payments.py": {"Input Payment Frequency": "Monthly", "Input Payment Amount": "EUR 2500",
+                       "Distribution Frequency": "Monthly"},
+    "ai_vaults.py": {"Duration": "12 months", "Penalty": "2%", "Input Payments Frequency": "Weekly"},
+    "ai_tokentool.py": {"Token Name": "Rental Income Token", "Token Symbol": "RIT", "CanMint": "True"},
+}
+
+# Phrases in the user message that identify which prompt is being answered, checked in order.
+PROMPT_MARKERS = [
+    ("fused", "extract the initial configuration"),
+    ("selector", "Typical keywords"),
+    ("ai_tokentool.py", "UnifiedDataIndex"),
+    ("ai_vaults.py", "Penalty"),
+    ("ai_payments.py", "Input Payment Amount"),
+]
+
+SELECTOR_KEYWORDS = [("ai_vaults.py", ("vault", "lock", "penalty", "savings")),
+                     ("ai_tokentool.py", ("token", "mint", "symbol", "blacklist"))]
+
+MALFORMED_RESPONSE = "Sure! Here is the updated configuration: {\"Duration\": "
+
+
+def parse_latency(spec: str):
+    """Turn "fixed:S", "uniform:LO:HI", "normal:MEAN:SD", "lognormal:MU:SIGMA" or
+    "exponential:MEAN" (all in seconds) into a function returning one sample."""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":") if value]
+    samplers = {
+        "fixed": lambda: values[0],
+        "uniform": lambda: random.uniform(values[0], values[1]),
+        "normal": lambda: max(0.0, random.gauss(values[0], values[1])),
+        "lognormal": lambda: random.lognormvariate(values[0], values[1]),
+        "exponential": lambda: random.expovariate(1 / values[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    return samplers[kind]
+
+
+def detect_prompt(messages: list) -> str:
+    text = " ".join(message.get("content", "") for message in messages)
+    for kind, marker in PROMPT_MARKERS:
+        if marker in text:
+            return kind
+    return "ai_payments.py"
+
+
+def selector_input(messages: list) -> str:
+    text = messages[-1].get("content", "")
+    return text.rsplit("User Input:", 1)[-1].strip().split("\n", 1)[0]
+
+
+def selector_target(user_input: str) -> str:
+    text = user_input.lower()
+    for target, keywords in SELECTOR_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return target
+    return "ai_payments.py"
+
+
+class MockOpenAI:
+    """Answers /v1/chat/completions with canned JSON after a sampled delay."""
+
+    def __init__(self, latency="fixed:0.05", responses=None, malformed_rate=0.0, error_rate=0.0,
+                 chunk_size=8, chunk_delay=0.005):
+        self.sample_latency = parse_latency(latency)
+        self.responses = dict(CANNED_RESPONSES, **(responses or {}))
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.stats = {"requests": 0, "malformed": 0, "errors": 0}
+
+    def content_for(self, messages: list) -> str:
+        if random.random() < self.malformed_rate:
+            self.stats["malformed"] += 1
+            return MALFORMED_RESPONSE
+        kind = detect_prompt(messages)
+        if kind == "selector":
+            user_input = selector_input(messages)
+            return json.dumps({"Target": selector_target(user_input), "Prompt": user_input})
+        if kind == "fused":
+            target = selector_target(selector_input(messages))
+            return json.dumps({"Target": target, "Config": self.responses[target]})
+        return json.dumps(self.responses[kind])
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.sample_latency())
+        if random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "Injected failure", "type": "server_error"}}, status=500)
+
+        messages = body.get("messages", [])
+        content = self.content_for(messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return await self.stream(request, completion_id, created, model, content)
+
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    async def stream(self, request, completion_id, created, model, content):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for start in range(0, len(content), self.chunk_size):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + self.chunk_size]},
+                             "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+
+def start_in_thread(mock: MockOpenAI, host: str = "127.0.0.1", port: int = 0):
+    """Serve the mock on a background event loop; return (base_url, stop)."""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(mock.create_app())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port)
+    loop.run_until_complete(site.start())
+    bound_port = runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return f"http://{host}:{bound_port}/v1", stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in with canned responses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default="fixed:0.05", help="e.g. lognormal:-2.3:0.5 (seconds)")
+    parser.add_argument("--responses", help="JSON file mapping protocol to the delta it should return")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of replies that are not JSON")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r") as f:
+            responses = json.load(f)
+    mock = MockOpenAI(args.latency, responses, args.malformed_rate, args.error_rate)
+    web.run_app(mock.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
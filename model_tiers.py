@@ -0,0 +1,107 @@
+import os
+import time
+
+import metrics
+from config_delta import parse_delta
+from rule_extractor import extract as extract_rules
+from schema_registry import PLACEHOLDERS
+
+# Models ordered from the fastest and cheapest to the strongest. Empty keeps each module's own MODEL.
+TIERS = [model.strip() for model in os.environ.get("MODEL_TIERS", "").split(",") if model.strip()]
+# Inputs of at most this many words start at the fastest tier; longer ones go straight to the strongest.
+SIMPLE_MAX_WORDS = int(os.environ.get("MODEL_TIER_SIMPLE_WORDS", "12"))
+
+
+def tiers(default_model: str) -> list:
+    return TIERS or [default_model]
+
+
+def strongest_model(default_model: str) -> str:
+    """The model for calls that cannot be escalated once started, such as streams."""
+    return tiers(default_model)[-1]
+
+
+def cache_model(default_model: str) -> str:
+    """The model part of a cache key; any tier of the ladder may have produced the answer."""
+    return ",".join(tiers(default_model))
+
+
+def route(user_input: str) -> str:
+    return "simple" if len(user_input.split()) <= SIMPLE_MAX_WORDS else "complex"
+
+
+def ladder(default_model: str, route_name: str) -> list:
+    """The models to try in order for a route."""
+    models = tiers(default_model)
+    return models if route_name == "simple" else models[-1:]
+
+
+def rejection(schema, response_text: str, updated_config, expected: dict):
+    """Return why a tier's output should be escalated, or None to accept it.
+
+    The output is rejected when it has no JSON object, when it proposes a value
+    or field the schema does not allow, or when a field the rule extractor
+    found in the input was left at its fallback.
+    """
+    if updated_config is None:
+        return "parse_failure"
+    if schema.check_delta(parse_delta(response_text)):
+        return "invalid"
+    for field, value in expected.items():
+        spec = schema.fields.get(field)
+        result = updated_config.get(field)
+        if spec is not None and result != value and (result == spec.fallback or result in PLACEHOLDERS):
+            return "unexplained"
+    return None
+
+
+def _record(protocol, model, route_name, seconds, reason):
+    metrics.TIER_SECONDS.observe(seconds, protocol, model, route_name)
+    metrics.TIER_RESULTS.inc(protocol, model, route_name, reason or "accepted")
+
+
+def complete_update(protocol, default_model, schema, user_input, current_config, messages, create, parse):
+    """Ask the model ladder for an update, escalating until a tier's output is accepted.
+
+    `create(model=..., messages=...)` makes the completion and `parse(text)`
+    turns its reply into the updated config or None. Returns what the last
+    tier tried produced, which may be None.
+    """
+    route_name = route(user_input)
+    expected = extract_rules(protocol, user_input, current_config)[0]
+    updated_config = None
+    for model in ladder(default_model, route_name):
+        start = time.perf_counter()
+        with metrics.timed(protocol, "api_call"):
+            response = create(model=model, messages=messages)
+        seconds = time.perf_counter() - start
+        metrics.record_usage(protocol, model, response)
+
+        response_text = response.choices[0].message.content.strip()
+        updated_config = parse(response_text)
+        reason = rejection(schema, response_text, updated_config, expected)
+        _record(protocol, model, route_name, seconds, reason)
+        if reason is None:
+            break
+    return updated_config
+
+
+async def acomplete_update(protocol, default_model, schema, user_input, current_config, messages, create, parse):
+    """Async variant of complete_update; create must return an awaitable."""
+    route_name = route(user_input)
+    expected = extract_rules(protocol, user_input, current_config)[0]
+    updated_config = None
+    for model in ladder(default_model, route_name):
+        start = time.perf_counter()
+        with metrics.timed(protocol, "api_call"):
+            response = await create(model=model, messages=messages)
+        seconds = time.perf_counter() - start
+        metrics.record_usage(protocol, model, response)
+
+        response_text = response.choices[0].message.content.strip()
+        updated_config = parse(response_text)
+        reason = rejection(schema, response_text, updated_config, expected)
+        _record(protocol, model, route_name, seconds, reason)
+        if reason is None:
+            break
+    return updated_config
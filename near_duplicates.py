@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import threading
+
+from interaction_store import PROTOCOL_IDS, InteractionStore
+from response_cache import normalize_input
+
+# Empty disables write-time deduplication.
+INDEX_PATH = os.environ.get("NEAR_DUPLICATE_PATH", "near_duplicates.db")
+THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+MAX_CANDIDATES = 50
+COMPACT_BATCH = 1000
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}I")
+
+
+def _permutations():
+    """Fixed (a, b) pairs so signatures stay comparable across processes and runs."""
+    seed = b"near-duplicates"
+    pairs = []
+    for i in range(NUM_PERM):
+        digest = hashlib.blake2b(seed + i.to_bytes(2, "little"), digest_size=16).digest()
+        pairs.append((int.from_bytes(digest[:8], "little") % (_PRIME - 1) + 1,
+                      int.from_bytes(digest[8:], "little") % _PRIME))
+    return pairs
+
+
+PERMUTATIONS = _permutations()
+
+
+def shingles(user_input: str, config: dict):
+    """Character shingles of the normalized input plus one shingle per config field."""
+    text = normalize_input(user_input)
+    found = {"i:" + text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    for key, value in config.items():
+        found.add("c:" + key + "=" + json.dumps(value, sort_keys=True))
+    return found
+
+
+def minhash(features) -> tuple:
+    """Return the NUM_PERM-value MinHash signature of a set of strings."""
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little")
+              for f in features]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) & _MASK for a, b in PERMUTATIONS)
+
+
+def similarity(first, second) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(first, second)) / NUM_PERM
+
+
+def band_buckets(signature):
+    """Yield (band, bucket) with the bucket a signed 64-bit hash of the band's rows."""
+    packed = _SIGNATURE.pack(*signature)
+    for band in range(BANDS):
+        rows = packed[band * ROWS * 4:(band + 1) * ROWS * 4]
+        yield band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "little", signed=True)
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with LSH banding kept in SQLite, so memory use stays flat."""
+
+    def __init__(self, path=INDEX_PATH, threshold=THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures "
+            "(id INTEGER PRIMARY KEY, protocol INTEGER NOT NULL, signature BLOB NOT NULL, "
+            "duplicates INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (protocol INTEGER, band INTEGER, bucket INTEGER, id INTEGER, "
+            "PRIMARY KEY (protocol, band, bucket, id)) WITHOUT ROWID"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _find(self, conn, protocol_id, signature, buckets):
+        candidates = set()
+        for band, bucket in buckets:
+            rows = conn.execute(
+                "SELECT id FROM buckets WHERE protocol = ? AND band = ? AND bucket = ? LIMIT ?",
+                (protocol_id, band, bucket, MAX_CANDIDATES)
+            ).fetchall()
+            candidates.update(row[0] for row in rows)
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+        best = None
+        for candidate in candidates:
+            stored = conn.execute("SELECT signature FROM signatures WHERE id = ?", (candidate,)).fetchone()
+            score = similarity(signature, _SIGNATURE.unpack(stored[0]))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        return best
+
+    def query(self, protocol: str, user_input: str, config: dict):
+        """Return (id, similarity) of the closest indexed near-duplicate, or None."""
+        signature = minhash(shingles(user_input, config))
+        return self._find(self._connect(), PROTOCOL_IDS[protocol], signature, list(band_buckets(signature)))
+
+    def add(self, protocol: str, user_input: str, config: dict, commit: bool = True):
+        """Index the interaction unless a near-duplicate is already indexed.
+
+        Returns the id of the existing near-duplicate, whose duplicate count is
+        bumped, or None when the interaction was new and has been indexed.
+        With commit=False the caller batches several adds and calls commit().
+        """
+        protocol_id = PROTOCOL_IDS[protocol]
+        signature = minhash(shingles(user_input, config))
+        buckets = list(band_buckets(signature))
+        conn = self._connect()
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            match = self._find(conn, protocol_id, signature, buckets)
+            if match is not None:
+                conn.execute("UPDATE signatures SET duplicates = duplicates + 1 WHERE id = ?", (match[0],))
+                return match[0]
+            row_id = conn.execute(
+                "INSERT INTO signatures (protocol, signature) VALUES (?, ?)",
+                (protocol_id, _SIGNATURE.pack(*signature))
+            ).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?)",
+                [(protocol_id, band, bucket, row_id) for band, bucket in buckets]
+            )
+            return None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            if commit and conn.in_transaction:
+                conn.execute("COMMIT")
+
+    def commit(self):
+        conn = self._connect()
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide near-duplicate index, or None when it is disabled."""
+    global _index
+    if _index is None and INDEX_PATH:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex()
+    return _index
+
+
+def seen_before(protocol: str, user_input: str, config: dict) -> bool:
+    """Index an interaction at write time; True when a near-duplicate was already stored."""
+    index = get_index()
+    return index is not None and index.add(protocol, user_input, config) is not None
+
+
+def compact(source: InteractionStore, target: InteractionStore, index_path: str, threshold=THRESHOLD):
+    """Copy the source store into the target, dropping near-duplicates; return (kept, dropped)."""
+    index = NearDuplicateIndex(index_path, threshold)
+    kept = dropped = 0
+    for interaction in source.scan():
+        messages = interaction["messages"]
+        user_input, config = messages[0]["content"], json.loads(messages[1]["content"])
+        if index.add(interaction["protocol"], user_input, config, commit=False) is None:
+            target.append(interaction["protocol"], user_input, config, interaction["score"],
+                          timestamp=interaction["timestamp"])
+            kept += 1
+        else:
+            dropped += 1
+        if (kept + dropped) % COMPACT_BATCH == 0:
+            index.commit()
+    index.commit()
+    target.flush()
+    return kept, dropped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy an interaction store without its near-duplicates.")
+    parser.add_argument("source", help="Interaction store directory to read")
+    parser.add_argument("target", help="Interaction store directory to write")
+    parser.add_argument("--index", default="compaction.db", help="SQLite file for the compaction index")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Minimum estimated Jaccard similarity")
+    args = parser.parse_args(argv)
+
+    kept, dropped = compact(InteractionStore(args.source), InteractionStore(args.target), args.index, args.threshold)
+    print(json.dumps({"kept": kept, "dropped": dropped}))
+
+
+if __name__ == "__main__":
+    main()
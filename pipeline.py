@@ -0,0 +1,132 @@
+import copy
+import json
+
+import ai_payments
+import ai_selector
+import ai_tokentool
+import ai_vaults
+from config_delta import apply_delta
+from session_store import get_sessions
+
+# Update functions and starting configuration of every selector target.
+TARGETS = {
+    "ai_payments.py": (ai_payments.create_or_update_payment_stream, ai_payments.DEFAULT_CONFIG),
+    "ai_vaults.py": (ai_vaults.create_or_update_token_vault, ai_vaults.DEFAULT_CONFIG),
+    "ai_tokentool.py": (ai_tokentool.create_or_update_token_config, ai_tokentool.DEFAULT_CONFIG),
+}
+
+ASYNC_TARGETS = {
+    "ai_payments.py": ai_payments.acreate_or_update_payment_stream,
+    "ai_vaults.py": ai_vaults.acreate_or_update_token_vault,
+    "ai_tokentool.py": ai_tokentool.acreate_or_update_token_config,
+}
+
+STREAM_TARGETS = {
+    "ai_payments.py": ai_payments.astream_payment_stream_updates,
+    "ai_vaults.py": ai_vaults.astream_token_vault_updates,
+    "ai_tokentool.py": ai_tokentool.astream_token_config_updates,
+}
+
+
+# How a fused selector result becomes a config: the target's fields, its field validator and the
+# input triggers it applies before asking the model.
+FUSED_TARGETS = {
+    "ai_payments.py": (ai_payments.PROTOCOL_FIELDS, ai_payments.validate_field, None),
+    "ai_vaults.py": (ai_vaults.PROTOCOL_FIELDS, ai_vaults.validate_field, None),
+    "ai_tokentool.py": (ai_tokentool.PROTOCOL_FIELDS, ai_tokentool.sanitize_field, ai_tokentool.apply_input_triggers),
+}
+
+
+def init_protocols():
+    """Set up the selector and every engine now instead of on their first request."""
+    for module in (ai_selector, ai_payments, ai_vaults, ai_tokentool):
+        module.init()
+
+
+def starting_config(target: str, config: dict = None) -> dict:
+    """Return a private copy of the given config, or of the target's default."""
+    return copy.deepcopy(config if config else TARGETS[target][1])
+
+
+def session_config(target: str, config: dict = None, session_id: str = None) -> dict:
+    """Like starting_config, but continue from the session's config when it is for the same target."""
+    if not config and session_id:
+        session = get_sessions().get(session_id)
+        if session is not None and session[0] == target:
+            return session[1]
+    return starting_config(target, config)
+
+
+def save_session(session_id: str, target: str, config: dict):
+    if session_id:
+        get_sessions().set(session_id, target, config)
+
+
+def use_fused(config: dict = None, session_id: str = None) -> bool:
+    """Fused mode only starts new conversations: no config was sent and the session is empty."""
+    return ai_selector.FUSED and not config and not (session_id and get_sessions().get(session_id))
+
+
+def apply_fused(target: str, user_input: str, delta: dict) -> dict:
+    fields, validate_field, prepare = FUSED_TARGETS[target]
+    config = starting_config(target)
+    if prepare is not None:
+        config = prepare(user_input, config)
+    return apply_delta(config, delta, fields, validate_field)
+
+
+def iter_pipeline(user_input: str, config: dict = None, session_id: str = None):
+    """Yield the selector result, then the target's updated configuration.
+
+    With a session id the update continues from, and is saved back to, that
+    session's config. In fused mode a new conversation is answered by one
+    completion, falling back to the two calls when its output does not fit.
+    """
+    fused = ai_selector.classify_and_extract(user_input) if use_fused(config, session_id) else None
+    if fused is not None:
+        target, delta = fused
+        yield "selector", {"Target": target, "Prompt": user_input}
+        updated = apply_fused(target, user_input, delta)
+        save_session(session_id, target, updated)
+        yield "target", updated
+        return
+
+    selection = json.loads(ai_selector.determine_protocol(user_input))
+    yield "selector", selection
+    if "error" in selection:
+        return
+    target = selection["Target"]
+    updated = TARGETS[target][0](selection["Prompt"], session_config(target, config, session_id))
+    save_session(session_id, target, updated)
+    yield "target", updated
+
+
+async def aiter_pipeline(user_input: str, config: dict = None, session_id: str = None):
+    """Async variant of iter_pipeline on the shared AsyncOpenAI client."""
+    fused = await ai_selector.aclassify_and_extract(user_input) if use_fused(config, session_id) else None
+    if fused is not None:
+        target, delta = fused
+        yield "selector", {"Target": target, "Prompt": user_input}
+        updated = apply_fused(target, user_input, delta)
+        save_session(session_id, target, updated)
+        yield "target", updated
+        return
+
+    selection = json.loads(await ai_selector.adetermine_protocol(user_input))
+    yield "selector", selection
+    if "error" in selection:
+        return
+    target = selection["Target"]
+    updated = await ASYNC_TARGETS[target](selection["Prompt"], session_config(target, config, session_id))
+    save_session(session_id, target, updated)
+    yield "target", updated
+
+
+def run_pipeline(user_input: str, config: dict = None, session_id: str = None) -> dict:
+    """Classify the input and update the chosen protocol's config in one call."""
+    return dict(iter_pipeline(user_input, config, session_id))
+
+
+async def arun_pipeline(user_input: str, config: dict = None, session_id: str = None) -> dict:
+    """Async variant of run_pipeline."""
+    return {stage: result async for stage, result in aiter_pipeline(user_input, config, session_id)}
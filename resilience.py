@@ -0,0 +1,295 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import metrics
+
+# Total time budget of one API call, retries and backoff included, in seconds.
+DEADLINE = float(os.environ.get("API_DEADLINE", "30"))
+RETRIES = int(os.environ.get("API_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("API_BACKOFF_BASE", "0.25"))
+BACKOFF_MAX = float(os.environ.get("API_BACKOFF_MAX", "4"))
+# Send a duplicate request when the first one is slower than the observed p95.
+HEDGE = os.environ.get("API_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = int(os.environ.get("API_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+# Consecutive upstream failures that open the breaker, and seconds before it lets a trial call through.
+BREAKER_FAILURES = int(os.environ.get("API_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("API_BREAKER_RESET", "30"))
+
+RETRYABLE_STATUS = frozenset([408, 409, 429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(Exception):
+    """The upstream failed repeatedly and calls are being refused until it recovers."""
+
+
+class DeadlineExceeded(Exception):
+    """The call's time budget ran out before a successful response."""
+
+
+def is_retryable(error: Exception) -> bool:
+    from openai import APIConnectionError, APIStatusError
+    if isinstance(error, (APIConnectionError, TimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies."""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Closed until BREAKER_FAILURES consecutive failures, then open for BREAKER_RESET seconds,
+    then half-open: one trial call decides whether it closes or opens again."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self._opened_at < self.reset_after else "half-open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_trackers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(key: str) -> CircuitBreaker:
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker()
+        return _breakers[key]
+
+
+def get_tracker(key: str) -> LatencyTracker:
+    with _registry_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
+
+
+def reset():
+    """Forget all breaker state and latency history."""
+    with _registry_lock:
+        _breakers.clear()
+        _trackers.clear()
+
+
+def _hedge_delay(key: str, remaining: float):
+    if not HEDGE:
+        return None
+    delay = get_tracker(key).percentile(HEDGE_PERCENTILE)
+    return delay if delay is not None and delay < remaining else None
+
+
+def _start_thread(fn, *args, **kwargs) -> Future:
+    """Run fn on a thread of its own and return a future for its result.
+
+    A thread per attempt rather than a fixed pool, so hedged calls never
+    queue behind each other and a hedge goes out when its delay is up.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return future
+
+
+def _attempt(create, key, remaining, kwargs):
+    delay = _hedge_delay(key, remaining)
+    if delay is None:
+        return create(timeout=remaining, **kwargs)
+
+    primary = _start_thread(create, timeout=remaining, **kwargs)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    metrics.RESILIENCE.inc(key, "hedge")
+    # The request that loses keeps its thread until it finishes or times out.
+    pending = {primary, _start_thread(create, timeout=remaining - delay, **kwargs)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+    raise error
+
+
+async def _aattempt(create, key, remaining, kwargs):
+    delay = _hedge_delay(key, remaining)
+    primary = asyncio.ensure_future(create(timeout=remaining, **kwargs))
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    metrics.RESILIENCE.inc(key, "hedge")
+    pending = {primary, asyncio.ensure_future(create(timeout=remaining - delay, **kwargs))}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _before_attempt(key, breaker, deadline_at):
+    if not breaker.allow():
+        metrics.RESILIENCE.inc(key, "circuit_open")
+        raise CircuitOpenError(f"Circuit open for {key}")
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        metrics.RESILIENCE.inc(key, "deadline")
+        raise DeadlineExceeded(f"Deadline exceeded for {key}")
+    return remaining
+
+
+def _after_failure(key, breaker, error, attempt, deadline_at):
+    """Record a failed attempt; return the backoff to sleep, or re-raise when giving up."""
+    if not is_retryable(error):
+        # The upstream answered; the request itself was bad.
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    pause = backoff(attempt)
+    if attempt >= RETRIES or time.monotonic() + pause >= deadline_at:
+        raise error
+    metrics.RESILIENCE.inc(key, "retry")
+    return pause
+
+
+def call(create, key: str, deadline: float = None, **kwargs):
+    """Run create(**kwargs) under the deadline, retry policy, hedging and breaker of `key`."""
+    deadline_at = time.monotonic() + (DEADLINE if deadline is None else deadline)
+    breaker = get_breaker(key)
+    attempt = 0
+    while True:
+        remaining = _before_attempt(key, breaker, deadline_at)
+        start = time.monotonic()
+        try:
+            result = _attempt(create, key, remaining, kwargs)
+        except Exception as e:
+            time.sleep(_after_failure(key, breaker, e, attempt, deadline_at))
+            attempt += 1
+            continue
+        breaker.record_success()
+        get_tracker(key).record(time.monotonic() - start)
+        return result
+
+
+async def acall(create, key: str, deadline: float = None, **kwargs):
+    """Async variant of call; create must return an awaitable."""
+    deadline_at = time.monotonic() + (DEADLINE if deadline is None else deadline)
+    breaker = get_breaker(key)
+    attempt = 0
+    while True:
+        remaining = _before_attempt(key, breaker, deadline_at)
+        start = time.monotonic()
+        try:
+            result = await _aattempt(create, key, remaining, kwargs)
+        except Exception as e:
+            await asyncio.sleep(_after_failure(key, breaker, e, attempt, deadline_at))
+            attempt += 1
+            continue
+        breaker.record_success()
+        get_tracker(key).record(time.monotonic() - start)
+        return result
+
+
+def open_stream(create, key: str, deadline: float = None, **kwargs):
+    """Open a streamed completion under the breaker and deadline; streams are not retried or hedged."""
+    breaker = get_breaker(key)
+    remaining = _before_attempt(key, breaker, time.monotonic() + (DEADLINE if deadline is None else deadline))
+    try:
+        stream = create(timeout=remaining, **kwargs)
+    except Exception as e:
+        if is_retryable(e):
+            breaker.record_failure()
+        raise
+    breaker.record_success()
+    return stream
+
+
+async def aopen_stream(create, key: str, deadline: float = None, **kwargs):
+    """Async variant of open_stream."""
+    breaker = get_breaker(key)
+    remaining = _before_attempt(key, breaker, time.monotonic() + (DEADLINE if deadline is None else deadline))
+    try:
+        stream = await create(timeout=remaining, **kwargs)
+    except Exception as e:
+        if is_retryable(e):
+            breaker.record_failure()
+        raise
+    breaker.record_success()
+    return stream
@@ -0,0 +1,138 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+# Set to a file path to keep cached responses across process restarts.
+CACHE_DISK_PATH = os.environ.get("RESPONSE_CACHE_PATH")
+
+
+def normalize_input(user_input: str) -> str:
+    """Collapse whitespace so trivially different prompts share an entry.
+
+    Case is kept: names, symbols and addresses in a prompt are case-sensitive.
+    """
+    return " ".join(user_input.split())
+
+
+def make_key(namespace: str, user_input: str, current_config: dict, model: str) -> str:
+    """Hash the normalized input, the canonical current config and the model name."""
+    payload = json.dumps(
+        [namespace, normalize_input(user_input), current_config, model],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """SQLite-backed second tier shared by every process pointing at the same file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._connect().execute(
+            "SELECT value, expires FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, 0.0
+        value, expires = row
+        if expires < time.time():
+            with self._connect() as conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None, 0.0
+        return json.loads(value), expires
+
+    def set(self, key: str, value, expires: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """In-memory LRU with TTL eviction in front of an optional on-disk tier."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, disk_path=CACHE_DISK_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = DiskCache(disk_path) if disk_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str):
+        """Return a private copy of the cached value, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires >= now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+        if self.disk is not None:
+            value, expires = self.disk.get(key)
+            if value is not None:
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                    self._store(key, value, expires)
+                return copy.deepcopy(value)
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value):
+        expires = time.time() + self.ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, value, expires)
+        if self.disk is not None:
+            self.disk.set(key, value, expires)
+
+    def _store(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,164 @@
+import re
+
+FREQUENCIES = {
+    "daily": "Daily", "every day": "Daily",
+    "weekly": "Weekly", "every week": "Weekly",
+    "monthly": "Monthly", "every month": "Monthly",
+    "quarterly": "Quarterly", "every quarter": "Quarterly",
+    "half-yearly": "Half-yearly", "half yearly": "Half-yearly", "semi-annual": "Half-yearly",
+    "semi-annually": "Half-yearly", "semiannual": "Half-yearly", "semiannually": "Half-yearly",
+    "yearly": "Yearly", "annual": "Yearly", "annually": "Yearly", "every year": "Yearly",
+}
+
+CURRENCIES = {
+    "eth": "ETH", "ether": "ETH", "eur": "EUR", "euro": "EUR", "euros": "EUR", "€": "EUR",
+    "usd": "USD", "dollar": "USD", "dollars": "USD", "$": "USD",
+}
+
+# Token tool compliance switches and the phrases that name them.
+TOGGLES = {
+    "Freeze": ["freeze", "freezing", "freezable"],
+    "PauseTokens": ["pause", "pausing", "pausable"],
+    "ForceTransfer": ["force transfers", "force transfer", "forced transfers", "forced transfer"],
+    "Blacklist": ["blacklist", "blacklisting"],
+    "Whitelist": ["whitelist", "whitelisting"],
+    "CanMint": ["minting", "mintable", "mint"],
+    "PreferenceSignature": ["preference signatures", "preference signature"],
+    "TokenFee": ["transaction fees", "transaction fee", "token fees", "token fee", "fees", "fee"],
+}
+
+ON_WORDS = ["turn on", "switch on", "enable", "activate", "allow", "add", "with"]
+OFF_WORDS = ["turn off", "switch off", "disable", "deactivate", "disallow", "remove", "without", "no"]
+STATE_WORDS = {"on": "True", "true": "True", "yes": "True", "enabled": "True",
+               "off": "False", "false": "False", "no": "False", "disabled": "False"}
+
+# Words that carry no configuration meaning of their own.
+FILLER = frozenset([
+    "a", "an", "the", "it", "its", "it's", "make", "set", "change", "switch", "update", "use",
+    "to", "be", "is", "should", "please", "and", "also", "instead", "now", "of", "for", "in",
+    "at", "with", "my", "i", "want", "let's", "lets", "can", "you", "them", "all", "just",
+    "pay", "paid", "payments", "payment", "frequency", "amount", "currency", "vault",
+    "duration", "lock", "penalty", "tokens", "token", "ok", "okay", "then", "so",
+    "input", "inputs", "deposit", "deposits", "distribution", "distributions", "payout", "payouts",
+])
+
+DISTRIBUTION_CONTEXT = re.compile(r"distribut|payout|pay out|dividend|output")
+INPUT_CONTEXT = re.compile(r"\binput|deposit|pay in\b|contribut")
+
+_NUMBER = r"\d[\d,]*(?:\.\d+)?"
+
+
+def _alternation(phrases):
+    return "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+
+
+FREQUENCY_RE = re.compile(rf"\b(?:{_alternation(FREQUENCIES)})\b")
+AMOUNT_RE = re.compile(
+    rf"(?:\b(eth|eur)\s*({_NUMBER})\b|€\s*({_NUMBER})\b|\b({_NUMBER})\s*(eth|eur|euros?)\b|\b({_NUMBER})\s*€)"
+)
+CURRENCY_RE = re.compile(rf"(?:\b(?:{_alternation(k for k in CURRENCIES if k.isalpha())})\b|[€$])")
+DURATION_RE = re.compile(r"\b(\d+)\s*-?\s*(months?|mo|years?|yrs?)\b")
+PENALTY_RE = re.compile(
+    r"\b(\d+(?:\.\d+)?)\s*%\s*(?:early\s+)?(?:withdrawal\s+)?penalty\b"
+    r"|\bpenalty\s*(?:of|to|at|is|:|=)?\s*(\d+(?:\.\d+)?)\s*%"
+)
+_TOGGLE_NAMES = _alternation([p for phrases in TOGGLES.values() for p in phrases])
+TOGGLE_PREFIX_RE = re.compile(
+    rf"\b({_alternation(ON_WORDS + OFF_WORDS)})\s+(?:the\s+)?({_TOGGLE_NAMES})\b"
+)
+TOGGLE_SUFFIX_RE = re.compile(
+    rf"\b({_TOGGLE_NAMES})\s*(?:=|:|to|is)?\s*({_alternation(STATE_WORDS)})\b"
+)
+_TOGGLE_FIELDS = {phrase: field for field, phrases in TOGGLES.items() for phrase in phrases}
+
+
+def _format_number(text: str) -> str:
+    number = float(text.replace(",", ""))
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def _frequency_field(text: str, current_config: dict, input_field: str, distribution_field: str):
+    """Decide which frequency field a bare frequency refers to, or None if ambiguous."""
+    if DISTRIBUTION_CONTEXT.search(text):
+        return distribution_field
+    if INPUT_CONTEXT.search(text):
+        return input_field
+    defined = [field for field in (input_field, distribution_field)
+               if current_config.get(field, "Not defined") != "Not defined"]
+    return defined[0] if len(defined) == 1 else None
+
+
+def _frequency_rules(text, current_config, input_field, distribution_field):
+    matches = list(FREQUENCY_RE.finditer(text))
+    if len(matches) != 1:
+        return []
+    field = _frequency_field(text, current_config, input_field, distribution_field)
+    if field is None:
+        return []
+    match = matches[0]
+    return [(match.span(), field, FREQUENCIES[match.group(0)])]
+
+
+def payment_rules(text: str, current_config: dict):
+    found = _frequency_rules(text, current_config, "Input Payment Frequency", "Distribution Frequency")
+    for match in AMOUNT_RE.finditer(text):
+        currency = match.group(1) or match.group(5) or "eur"
+        amount = match.group(2) or match.group(3) or match.group(4) or match.group(6)
+        currency = CURRENCIES[currency.rstrip("s")] if currency != "€" else "EUR"
+        found.append((match.span(), "Input Payment Amount", f"{currency} {_format_number(amount)}"))
+    return found
+
+
+def vault_rules(text: str, current_config: dict):
+    found = _frequency_rules(text, current_config, "Input Payments Frequency", "Distribution Frequency")
+    for match in DURATION_RE.finditer(text):
+        months = int(match.group(1)) * (12 if match.group(2).startswith("y") else 1)
+        if 1 <= months <= 36:
+            found.append((match.span(), "Duration", f"{months} months"))
+    for match in PENALTY_RE.finditer(text):
+        penalty = float(match.group(1) or match.group(2))
+        if 0.01 <= penalty <= 10:
+            found.append((match.span(), "Penalty", f"{_format_number(str(penalty))}%"))
+    for match in CURRENCY_RE.finditer(text):
+        found.append((match.span(), "Input Payment Currency", CURRENCIES[match.group(0)]))
+    return found
+
+
+def token_rules(text: str, current_config: dict):
+    found = []
+    for match in TOGGLE_PREFIX_RE.finditer(text):
+        value = "False" if match.group(1) in OFF_WORDS else "True"
+        found.append((match.span(), _TOGGLE_FIELDS[match.group(2)], value))
+    for match in TOGGLE_SUFFIX_RE.finditer(text):
+        found.append((match.span(), _TOGGLE_FIELDS[match.group(1)], STATE_WORDS[match.group(2)]))
+    return found
+
+
+RULES = {
+    "ai_payments.py": payment_rules,
+    "ai_vaults.py": vault_rules,
+    "ai_tokentool.py": token_rules,
+}
+
+
+def extract(protocol: str, user_input: str, current_config: dict):
+    """Apply the deterministic rules for a protocol to the input.
+
+    Returns (updates, fully_explained). `fully_explained` is True only when
+    every word of the input was matched by a rule or is filler, so the
+    updates can be applied without asking the model.
+    """
+    text = user_input.lower()
+    updates = {}
+    covered = [False] * len(text)
+    for (start, end), field, value in RULES[protocol](text, current_config):
+        if field in updates and updates[field] != value:
+            # Two rules disagree about a field; let the model sort it out.
+            return {}, False
+        updates[field] = value
+        covered[start:end] = [True] * (end - start)
+
+    leftover = "".join(" " if covered[i] else ch for i, ch in enumerate(text))
+    words = re.findall(r"[a-z0-9'$€%]+", leftover)
+    explained = bool(updates) and all(word in FILLER for word in words)
+    return updates, explained
@@ -0,0 +1,223 @@
+import copy
+import re
+
+# Per-field error codes returned by the validators.
+INVALID_OPTION = "invalid_option"
+INVALID_AMOUNT = "invalid_amount"
+INVALID_FORMAT = "invalid_format"
+OUT_OF_RANGE = "out_of_range"
+INVALID_LIST = "invalid_list"
+UNKNOWN_FIELD = "unknown_field"
+MISSING_FIELD = "missing_field"
+
+# Options that stand for "free text, nothing entered yet" rather than a real choice.
+PLACEHOLDERS = frozenset(["Not defined", "No description", "Not provided"])
+
+_AMOUNT_RE = re.compile(r"^(ETH|EUR) \S")
+_DURATION_RE = re.compile(r"^\s*(\d+)\b")
+_PERCENTAGE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*%\s*$")
+
+
+def _is_placeholder(value):
+    return value in PLACEHOLDERS
+
+
+def parse_enum(spec, value):
+    # Options are strings; anything else, including unhashable lists and dicts, cannot be one.
+    if not isinstance(value, str) or value not in spec.options:
+        return None, INVALID_OPTION
+    return value, None
+
+
+def parse_text(spec, value):
+    """Numbers are accepted as text and stored as their string form."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value), None
+    return (value, None) if isinstance(value, str) else (None, INVALID_FORMAT)
+
+
+def parse_amount(spec, value):
+    if _is_placeholder(value):
+        return value, None
+    if isinstance(value, str) and _AMOUNT_RE.match(value):
+        return value, None
+    return None, INVALID_AMOUNT
+
+
+def parse_duration(spec, value):
+    """Durations are "<months> months" with 1 to 36 months."""
+    if _is_placeholder(value):
+        return value, None
+    match = _DURATION_RE.match(value) if isinstance(value, str) else None
+    if not match:
+        return None, INVALID_FORMAT
+    if not 1 <= int(match.group(1)) <= 36:
+        return None, OUT_OF_RANGE
+    return value, None
+
+
+def parse_percentage(spec, value):
+    """Percentages are "<number>%" between 0.01 and 10."""
+    if _is_placeholder(value):
+        return value, None
+    match = _PERCENTAGE_RE.match(value) if isinstance(value, str) else None
+    if not match:
+        return None, INVALID_FORMAT
+    if not 0.01 <= float(match.group(1)) <= 10:
+        return None, OUT_OF_RANGE
+    return value, None
+
+
+def parse_index_list(spec, value):
+    """Index lists hold the allowed indices as strings; ints are accepted and converted."""
+    if not isinstance(value, list):
+        return None, INVALID_LIST
+    indices = [str(item) for item in value]
+    if not all(item in spec.options for item in indices):
+        return None, OUT_OF_RANGE
+    return indices, None
+
+
+def parse_enum_list(spec, value):
+    if not isinstance(value, list) or not all(isinstance(item, str) and item in spec.options for item in value):
+        return None, INVALID_LIST
+    return value, None
+
+
+def parse_text_list(spec, value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return None, INVALID_LIST
+    return value, None
+
+
+PARSERS = {
+    "enum": parse_enum,
+    "text": parse_text,
+    "amount": parse_amount,
+    "duration": parse_duration,
+    "percentage": parse_percentage,
+    "index_list": parse_index_list,
+    "enum_list": parse_enum_list,
+    "text_list": parse_text_list,
+}
+
+
+class FieldSpec:
+    __slots__ = ("name", "kind", "options", "fallback", "parse")
+
+    def __init__(self, name, kind, options, fallback):
+        self.name = name
+        self.kind = kind
+        self.options = frozenset(options)
+        self.fallback = fallback
+        self.parse = PARSERS[kind]
+
+
+class CompiledSchema:
+    """A protocol's PROTOCOL_FIELDS compiled once into enum sets and typed parsers."""
+
+    def __init__(self, protocol, protocol_fields, field_types=None, defaults=None, fallback=None):
+        self.protocol = protocol
+        self.protocol_fields = protocol_fields
+        self.fields = {}
+        field_types = field_types or {}
+        defaults = defaults or {}
+        for name, options in protocol_fields.items():
+            if not isinstance(options, list):
+                options = [options]
+            kind = field_types.get(name)
+            if kind is None:
+                kind = "text" if all(_is_placeholder(option) for option in options) else "enum"
+            field_fallback = fallback if fallback is not None else defaults.get(name, options[0])
+            self.fields[name] = FieldSpec(name, kind, options, field_fallback)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def check_field(self, name, value):
+        """Return (normalized value, error code); the value is None when there is an error."""
+        spec = self.fields.get(name)
+        if spec is None:
+            return None, UNKNOWN_FIELD
+        return spec.parse(spec, value)
+
+    def validate_field(self, name, value):
+        """Return the normalized value, or the field's fallback when it is invalid."""
+        spec = self.fields.get(name)
+        if spec is None:
+            return value
+        normalized, error = spec.parse(spec, value)
+        return copy.deepcopy(spec.fallback) if error else normalized
+
+    def check_delta(self, delta):
+        """Return {field: error code} for the invalid fields of a model-proposed update.
+
+        JSON booleans are read as the "True"/"False" options.
+        """
+        errors = {}
+        for name, value in delta.items():
+            if isinstance(value, bool):
+                value = str(value)
+            error = self.check_field(name, value)[1]
+            if error:
+                errors[name] = error
+        return errors
+
+    def validate(self, config):
+        """Correct a config in place and return (config, {field: error code})."""
+        errors = {}
+        for name, value in config.items():
+            spec = self.fields.get(name)
+            if spec is None:
+                continue
+            normalized, error = spec.parse(spec, value)
+            if error:
+                errors[name] = error
+                config[name] = copy.deepcopy(spec.fallback)
+            else:
+                config[name] = normalized
+        return config, errors
+
+    def validate_many(self, configs, require_all=False):
+        """Check many configs without modifying them.
+
+        Returns one {field: error code} dict per config, empty when the config
+        is valid. With require_all, fields absent from a config are reported
+        as MISSING_FIELD.
+        """
+        fields = self.fields
+        results = []
+        for config in configs:
+            errors = {}
+            for name, value in config.items():
+                spec = fields.get(name)
+                if spec is None:
+                    errors[name] = UNKNOWN_FIELD
+                    continue
+                error = spec.parse(spec, value)[1]
+                if error:
+                    errors[name] = error
+            if require_all:
+                for name in fields.keys() - config.keys():
+                    errors[name] = MISSING_FIELD
+            results.append(errors)
+        return results
+
+
+_registry = {}
+
+
+def register(protocol, protocol_fields, field_types=None, defaults=None, fallback=None):
+    """Compile and register a protocol's schema, returning the compiled schema."""
+    schema = CompiledSchema(protocol, protocol_fields, field_types, defaults, fallback)
+    _registry[protocol] = schema
+    return schema
+
+
+def get_schema(protocol):
+    return _registry[protocol]
+
+
+def validate_many(protocol, configs, require_all=False):
+    """Batch-validate configs of a registered protocol; see CompiledSchema.validate_many."""
+    return _registry[protocol].validate_many(configs, require_all)
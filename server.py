@@ -1,25 +1,81 @@
-from flask import Flask, request, jsonify
+import argparse
+import json
+import time
+
+from flask import Flask, Response, g, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+
+import gateway
+import metrics
+from metrics import timed
+from pipeline import init_protocols, iter_pipeline, run_pipeline
 
 app = Flask(__name__)
 
+# One pooled session for all upstream calls instead of a new connection per request.
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=gateway.UPSTREAM_POOL_SIZE))
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.start, 'server', route, str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def forward(route, path, payload):
+    try:
+        with timed('server.py', f'upstream_{route}'):
+            response = session.post(
+                f'{gateway.BACKEND_URL}{path}',
+                json=payload,
+                timeout=gateway.ROUTE_TIMEOUTS[route]
+            )
+        return jsonify(response.json()), response.status_code
+    except requests.Timeout:
+        return jsonify({"error": "Upstream timeout"}), 504
+    except (requests.RequestException, ValueError) as e:
+        return jsonify({"error": str(e)}), 502
+
 @app.route('/api/selector', methods=['POST'])
 def selector():
     data = request.json
-    response = requests.post(
-        'http://localhost:8001/selector',
-        json={"user_input": data['user_input']}
-    )
-    return jsonify(response.json())
+    return forward('selector', '/selector', {"user_input": data['user_input']})
 
 @app.route('/api/target', methods=['POST'])
 def target():
     data = request.json
-    response = requests.post(
-        f'http://localhost:8001/{data["target"]}',
-        json={"user_input": data['prompt']}
-    )
-    return jsonify(response.json())
+    if not data.get("target"):
+        return jsonify({"error": "Missing target"}), 400
+    return forward('target', f'/{data["target"]}', {"user_input": data['prompt'], "session_id": data.get('session_id')})
+
+@app.route('/api/pipeline', methods=['POST'])
+def pipeline():
+    data = request.json
+    if request.args.get('stream') == '1':
+        def generate():
+            for stage, result in iter_pipeline(data['user_input'], data.get('config'), data.get('session_id')):
+                yield json.dumps({stage: result}) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    return jsonify(run_pipeline(data['user_input'], data.get('config'), data.get('session_id')))
 
 if __name__ == '__main__':
-    app.run(port=8000)
+    parser = argparse.ArgumentParser(description="Front-end API server.")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="serve through the aiohttp gateway instead of the Flask dev server")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    init_protocols()
+    if args.async_mode:
+        gateway.main(port=args.port)
+    else:
+        app.run(port=args.port)
@@ -0,0 +1,273 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import schema_registry
+
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", "500000"))
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "86400"))
+# Set to a file path to keep sessions across restarts.
+SESSION_SNAPSHOT_PATH = os.environ.get("SESSION_SNAPSHOT_PATH")
+# sqlite file holding the sessions when several worker processes must share them.
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+# The shared store removes expired and surplus sessions once per this many writes.
+SESSION_SWEEP_EVERY = 1000
+
+# Marks a slot whose field is absent from the config.
+_MISSING = None
+
+
+class SlotCodec:
+    """Encode a protocol's configs as tuples with one slot per schema field.
+
+    Enum values are stored as their small-int position in the sorted options
+    and free-text values as interned strings, so idle sessions that share
+    values also share the objects holding them. Any other value, including
+    an int or None sent for an enum field, is wrapped in a 1-tuple so it can
+    never be read back as an option code or as a missing field.
+    """
+
+    def __init__(self, schema: schema_registry.CompiledSchema):
+        self.names = list(schema.fields)
+        self.options = [
+            sorted(spec.options) if spec.kind == "enum" else None for spec in schema.fields.values()
+        ]
+        self.codes = [
+            {option: code for code, option in enumerate(options)} if options else None
+            for options in self.options
+        ]
+
+    def encode(self, config: dict) -> tuple:
+        slots = []
+        for name, codes in zip(self.names, self.codes):
+            if name not in config:
+                slots.append(_MISSING)
+                continue
+            value = config[name]
+            if isinstance(value, str):
+                slots.append(codes[value] if codes is not None and value in codes else sys.intern(value))
+            else:
+                slots.append((_freeze(value),))
+        return tuple(slots)
+
+    def decode(self, slots: tuple) -> dict:
+        config = {}
+        for name, options, value in zip(self.names, self.options, slots):
+            if value is _MISSING:
+                continue
+            if type(value) is int:
+                config[name] = options[value]
+            elif isinstance(value, tuple):
+                config[name] = _thaw(value[0])
+            else:
+                config[name] = value
+        return config
+
+
+def _freeze(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+_codecs = {}
+
+
+def get_codec(protocol: str) -> SlotCodec:
+    codec = _codecs.get(protocol)
+    if codec is None:
+        codec = _codecs[protocol] = SlotCodec(schema_registry.get_schema(protocol))
+    return codec
+
+
+class SessionStore:
+    """Per-session protocol configs with LRU and TTL eviction and optional disk snapshots."""
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, snapshot_path=SESSION_SNAPSHOT_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        # session id -> (protocol, slots, last access), least recently used first.
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        if snapshot_path:
+            if os.path.exists(snapshot_path):
+                self.load(snapshot_path)
+            atexit.register(self.snapshot)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: str):
+        """Return (protocol, config) of a live session, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or now - entry[2] > self.ttl:
+                if entry is not None:
+                    del self._sessions[session_id]
+                    self.stats["evictions"] += 1
+                self.stats["misses"] += 1
+                return None
+            protocol, slots, _ = entry
+            self._sessions[session_id] = (protocol, slots, now)
+            self._sessions.move_to_end(session_id)
+            self.stats["hits"] += 1
+        return protocol, get_codec(protocol).decode(slots)
+
+    def set(self, session_id: str, protocol: str, config: dict):
+        slots = get_codec(protocol).encode(config)
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = (protocol, slots, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now: float):
+        sessions = self._sessions
+        while sessions:
+            session_id, (_, _, last_access) = next(iter(sessions.items()))
+            if len(sessions) <= self.max_entries and now - last_access <= self.ttl:
+                break
+            sessions.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def snapshot(self, path: str = None):
+        """Write all live sessions to disk, replacing the previous snapshot atomically."""
+        path = path or self.snapshot_path
+        with self._lock:
+            entries = list(self._sessions.items())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for session_id, (protocol, slots, last_access) in entries:
+                f.write(json.dumps([session_id, protocol, slots, last_access]) + "\n")
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """Restore sessions from a snapshot, skipping the ones that have expired since."""
+        now = time.time()
+        with open(path, "r") as f, self._lock:
+            for line in f:
+                session_id, protocol, slots, last_access = json.loads(line)
+                if now - last_access <= self.ttl:
+                    self._sessions[session_id] = (protocol, tuple(_freeze(value) for value in slots), last_access)
+            self._evict(now)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, protocol TEXT, slots TEXT, last_access REAL);
+CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+"""
+
+
+class SharedSessionStore:
+    """SessionStore backed by a sqlite file, so forked worker processes see each other's sessions.
+
+    Every process and thread opens its own connection on first use. Sessions
+    persist in the file itself, so no snapshot is needed.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _conn(self):
+        # A connection must not cross fork(), so it is tied to the process that opened it.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get(self, session_id: str):
+        """Return (protocol, config) of a live session, or None."""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT protocol, slots, last_access FROM sessions WHERE id = ?",
+                           (session_id,)).fetchone()
+        if row is None or now - row[2] > self.ttl:
+            if row is not None:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self.stats["evictions"] += 1
+            self.stats["misses"] += 1
+            return None
+        conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+        self.stats["hits"] += 1
+        protocol, slots = row[0], tuple(_freeze(value) for value in json.loads(row[1]))
+        return protocol, get_codec(protocol).decode(slots)
+
+    def set(self, session_id: str, protocol: str, config: dict):
+        slots = get_codec(protocol).encode(config)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                     (session_id, protocol, json.dumps(slots), now))
+        self._writes += 1
+        if self._writes % SESSION_SWEEP_EVERY == 0:
+            self._evict(conn, now)
+
+    def delete(self, session_id: str):
+        self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _evict(self, conn, now: float):
+        evicted = conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl,)).rowcount
+        surplus = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_entries
+        if surplus > 0:
+            evicted += conn.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_access LIMIT ?)",
+                (surplus,)).rowcount
+        self.stats["evictions"] += evicted
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_sessions():
+    """Return the process-wide session store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
+
+
+def share_sessions(path: str = SESSION_DB_PATH):
+    """Keep sessions in a sqlite file shared by every process forked after this call."""
+    global _store
+    with _store_lock:
+        _store = SharedSessionStore(path)
+
+
+def shutdown():
+    """Write the snapshot of the process-wide store, for processes that leave without running atexit."""
+    if _store is not None and getattr(_store, "snapshot_path", None):
+        _store.snapshot()
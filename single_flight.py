@@ -0,0 +1,109 @@
+import asyncio
+import copy
+import functools
+import inspect
+import threading
+import weakref
+
+import metrics
+from response_cache import make_key
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Let concurrent callers with the same key share one execution.
+
+    Threads share through do(), tasks on the same event loop through ado().
+    The first caller runs the function; the others wait and receive a deep
+    copy of its result, or the same exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._tasks = weakref.WeakKeyDictionary()
+
+    def do(self, key: str, fn, *args, **kwargs):
+        """Return (result, shared); shared is True when another caller's execution was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            if waiters and call.error is None:
+                # A private copy, so the waiters never see the leader's caller modify it.
+                call.result = copy.deepcopy(result)
+            call.done.set()
+        return result, False
+
+    async def ado(self, key: str, fn, *args, **kwargs):
+        """Async variant of do(); the shared task is not cancelled when one of its waiters is."""
+        tasks = self._tasks.setdefault(asyncio.get_running_loop(), {})
+        entry = tasks.get(key)
+        shared = entry is not None
+        if shared:
+            entry[1] += 1
+        else:
+            entry = tasks[key] = [asyncio.ensure_future(fn(*args, **kwargs)), 0]
+            entry[0].add_done_callback(lambda _: tasks.pop(key, None))
+        result = await asyncio.shield(entry[0])
+        # Everyone gets a copy once the result is shared, so no caller sees another modify it.
+        return (copy.deepcopy(result), shared) if shared or entry[1] else (result, False)
+
+
+in_flight = SingleFlight()
+
+
+def coalesce(namespace: str, model: str):
+    """Decorate an (async) fn(user_input, *args) so identical concurrent calls run once.
+
+    Calls are identical when the normalized input, the remaining arguments
+    (the current config) and the model hash to the same key.
+    """
+    def decorator(fn):
+        def key_for(user_input, args, kwargs):
+            return make_key(namespace, user_input, [list(args), kwargs], model)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(user_input, *args, **kwargs):
+                result, shared = await in_flight.ado(key_for(user_input, args, kwargs), fn, user_input, *args, **kwargs)
+                if shared:
+                    metrics.count(namespace, "coalesced")
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(user_input, *args, **kwargs):
+            result, shared = in_flight.do(key_for(user_input, args, kwargs), fn, user_input, *args, **kwargs)
+            if shared:
+                metrics.count(namespace, "coalesced")
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,43 @@
+import functools
+import string
+import threading
+
+
+def run_once(setup):
+    """Decorate a setup function so only its first call runs, even when several threads race to it."""
+    lock = threading.Lock()
+    done = []
+
+    @functools.wraps(setup)
+    def wrapper():
+        if not done:
+            with lock:
+                if not done:
+                    setup()
+                    done.append(True)
+    return wrapper
+
+
+def compile_template(template: str, **fixed):
+    """Split a str.format template once, with the `fixed` fields already filled in.
+
+    Returns render(**values), which only joins the pieces with the remaining fields.
+    """
+    pieces, names = [""], []
+    for literal, name, _, _ in string.Formatter().parse(template):
+        pieces[-1] += literal
+        if name is None:
+            continue
+        if name in fixed:
+            pieces[-1] += str(fixed[name])
+        else:
+            names.append(name)
+            pieces.append("")
+
+    def render(**values):
+        parts = [pieces[0]]
+        for name, piece in zip(names, pieces[1:]):
+            parts.append(str(values[name]))
+            parts.append(piece)
+        return "".join(parts)
+    return render
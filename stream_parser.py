@@ -0,0 +1,115 @@
+import json
+
+
+class IncrementalObjectParser:
+    """Parse a streamed JSON object, returning each top-level member once its value is complete.
+
+    Text before the opening brace (e.g. "Sure, here it is:") is skipped. Members
+    whose value is not valid JSON are counted in `errors` and dropped.
+    """
+
+    def __init__(self):
+        self.state = "start"
+        self.buffer = []
+        self.key = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.errors = 0
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def feed(self, text: str) -> list:
+        """Consume a chunk of text and return the (key, value) pairs it completed."""
+        members = []
+        for ch in text:
+            if self.state == "start":
+                if ch == "{":
+                    self.state = "key_start"
+            elif self.state == "key_start":
+                if ch == '"':
+                    self.buffer = [ch]
+                    self.state = "key"
+                elif ch == "}":
+                    self.state = "done"
+            elif self.state == "key":
+                self.buffer.append(ch)
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.key = json.loads("".join(self.buffer))
+                    self.state = "colon"
+            elif self.state == "colon":
+                if ch == ":":
+                    self.buffer = []
+                    self.state = "value"
+            elif self.state == "value":
+                self._feed_value(ch, members)
+            elif self.state == "after_value":
+                if ch == ",":
+                    self.state = "key_start"
+                elif ch == "}":
+                    self.state = "done"
+            else:
+                break
+        return members
+
+    def _feed_value(self, ch, members):
+        if self.in_string:
+            self.buffer.append(ch)
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.depth == 0:
+                    # A top-level string is complete at its closing quote.
+                    self._emit(members)
+                    self.state = "after_value"
+            return
+
+        if ch == '"':
+            self.in_string = True
+        elif ch in "[{":
+            self.depth += 1
+        elif ch in "]}" and self.depth > 0:
+            self.depth -= 1
+        elif self.depth == 0 and ch in ",}":
+            self._emit(members)
+            self.state = "key_start" if ch == "," else "done"
+            return
+        self.buffer.append(ch)
+
+    def _emit(self, members):
+        try:
+            members.append((self.key, json.loads("".join(self.buffer))))
+        except json.JSONDecodeError:
+            self.errors += 1
+        self.buffer = []
+
+
+def iter_stream_fields(chunks, fields, validate_field):
+    """Yield validated (field, value) pairs from streamed text chunks as soon as each completes."""
+    parser = IncrementalObjectParser()
+    for chunk in chunks:
+        for key, value in parser.feed(chunk):
+            if key in fields:
+                yield key, validate_field(key, value)
+        if parser.done:
+            break
+
+
+async def aiter_stream_fields(chunks, fields, validate_field):
+    """Async variant of iter_stream_fields for async iterables of text chunks."""
+    parser = IncrementalObjectParser()
+    async for chunk in chunks:
+        for key, value in parser.feed(chunk):
+            if key in fields:
+                yield key, validate_field(key, value)
+        if parser.done:
+            break
@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import metrics
+
+LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Each log file rotates at this size, keeping LOG_BACKUPS older files.
+MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUPS = int(os.environ.get("LOG_BACKUPS", "5"))
+# Records waiting for the writer thread; beyond this they are dropped rather than blocking a request.
+QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Share of records whose full payload (e.g. a whole config) is written.
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+
+DROPPED = metrics.Counter("log_records_dropped_total", "Log records dropped because the queue was full.", ("logger",))
+
+
+def compact_dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, the record's fields and its payload."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        line = compact_dumps(entry)
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            # Serialized on the calling thread so later changes to the object cannot leak in.
+            line = f'{line[:-1]},"payload":{payload}}}'
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hand records to the writer thread without formatting them, dropping them when the queue is full."""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc(record.name)
+
+
+class RoutingHandler(logging.Handler):
+    """Runs on the writer thread and sends each record to the file of its logger."""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def add_route(self, name: str, filename: str):
+        handler = RotatingFileHandler(filename, maxBytes=MAX_BYTES, backupCount=BACKUPS,
+                                      encoding="utf-8", delay=True)
+        handler.setFormatter(JsonFormatter())
+        self.routes[name] = handler
+
+    def handle(self, record):
+        handler = self.routes.get(record.name)
+        if handler is not None:
+            handler.handle(record)
+
+    def close(self):
+        for handler in self.routes.values():
+            handler.close()
+        super().close()
+
+
+_lock = threading.Lock()
+_router = RoutingHandler()
+_queue_handler = None
+_listener = None
+
+
+def _start():
+    global _queue_handler, _listener
+    log_queue = queue.Queue(QUEUE_SIZE)
+    if _queue_handler is None:
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+    else:
+        _queue_handler.queue = log_queue
+    _listener = QueueListener(log_queue, _router)
+    _listener.start()
+
+
+def _restart_in_child():
+    # The writer thread does not survive fork(); give the child its own queue and thread.
+    global _lock
+    _lock = threading.Lock()
+    if _listener is not None:
+        _start()
+
+
+def shutdown():
+    """Write out every queued record and stop the writer thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            _router.close()
+
+
+def attach_log_file(logger: logging.Logger, filename: str):
+    """Route a module logger's records through the shared queue into its own rotating JSON-lines file."""
+    with _lock:
+        if _listener is None:
+            _start()
+        _router.add_route(logger.name, filename)
+        if _queue_handler not in logger.handlers:
+            logger.addHandler(_queue_handler)
+        logger.setLevel(LEVEL)
+        # Records stop here; a root handler, such as one logging.basicConfig() installs
+        # on the first module-level logging call, would write them to stderr on the caller's thread.
+        logger.propagate = False
+
+
+def log_event(logger: logging.Logger, message: str, **fields):
+    """Log an INFO record with structured fields."""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(message, extra={"fields": fields})
+
+
+def log_payload(logger: logging.Logger, message: str, payload, **fields):
+    """Like log_event, with the payload attached to a PAYLOAD_SAMPLE_RATE share of the records."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    extra = {"fields": fields}
+    if random.random() < PAYLOAD_SAMPLE_RATE:
+        extra["payload"] = compact_dumps(payload)
+    logger.info(message, extra=extra)
+
+
+atexit.register(shutdown)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
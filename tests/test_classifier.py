@@ -0,0 +1,18 @@
+import ai_selector
+from classifier import KeywordClassifier
+
+
+def classifier():
+    return KeywordClassifier.from_template(ai_selector.PROMPT_TEMPLATE)
+
+
+def test_single_keyword_stays_below_the_threshold():
+    for text in ["rent", "storage", "symbol", "maturity", "I want to rent my watches"]:
+        _, confidence = classifier().classify(text)
+        assert confidence < ai_selector.CONFIDENCE_THRESHOLD - 0.05, text
+
+
+def test_two_keywords_clear_the_threshold():
+    target, confidence = classifier().classify("monthly rent payment to my landlord")
+    assert target == "ai_payments.py"
+    assert confidence > ai_selector.CONFIDENCE_THRESHOLD + 0.05
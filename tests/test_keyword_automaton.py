@@ -0,0 +1,25 @@
+from keyword_automaton import KeywordAutomaton
+
+
+def values(automaton, text, **kwargs):
+    return [value for _, _, value in automaton.finditer(text, **kwargs)]
+
+
+def test_whole_words_only():
+    automaton = KeywordAutomaton({"contract": "c"})
+    assert values(automaton, "sign the Contract.") == ["c"]
+    assert values(automaton, "a subcontract") == []
+    assert values(automaton, "contractual terms") == []
+
+
+def test_suffixes_extend_the_last_word():
+    automaton = KeywordAutomaton({"investment contract": "ic"})
+    text = "attach the investment contracts"
+    assert list(automaton.finditer(text, suffixes=("s", "es"))) == [(11, len(text), "ic")]
+    assert values(automaton, text) == []
+    assert values(automaton, "investment contractual", suffixes=("s", "es")) == []
+
+
+def test_overlapping_phrases_all_match():
+    automaton = KeywordAutomaton({"linked to": "link", "all tokens": "all", "to all": "to-all"})
+    assert values(automaton, "linked to all tokens") == ["link", "to-all", "all"]
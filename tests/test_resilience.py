@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import resilience
+
+HEDGE_DELAY = 0.05
+STALL = 1.0
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Turn hedging on with a latency history whose p95 is HEDGE_DELAY."""
+    monkeypatch.setattr(resilience, "HEDGE", True)
+    resilience.reset()
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        resilience.get_tracker("test").record(HEDGE_DELAY)
+    yield
+    resilience.reset()
+
+
+def stalled_primary():
+    """A fake create whose first request stalls for STALL seconds and whose later ones answer at once."""
+    calls = []
+    lock = threading.Lock()
+
+    def create(timeout, **kwargs):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        if first:
+            time.sleep(STALL)
+            return "primary"
+        return "hedge"
+    return create, calls
+
+
+def test_sync_hedge_answers_a_stalled_primary(hedging):
+    create, calls = stalled_primary()
+    start = time.monotonic()
+    result = resilience.call(create, "test", deadline=5)
+    elapsed = time.monotonic() - start
+
+    assert result == "hedge"
+    assert len(calls) == 2
+    assert elapsed < STALL / 2
+
+
+def test_sync_fast_primary_sends_no_hedge(hedging):
+    calls = []
+
+    def create(timeout, **kwargs):
+        calls.append(timeout)
+        return "primary"
+
+    assert resilience.call(create, "test", deadline=5) == "primary"
+    time.sleep(HEDGE_DELAY * 2)
+    assert len(calls) == 1
+
+
+def test_async_hedge_answers_a_stalled_primary(hedging):
+    calls = []
+
+    async def create(timeout, **kwargs):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(STALL)
+            return "primary"
+        return "hedge"
+
+    start = time.monotonic()
+    result = asyncio.run(resilience.acall(create, "test", deadline=5))
+
+    assert result == "hedge"
+    assert time.monotonic() - start < STALL / 2
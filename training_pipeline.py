@@ -0,0 +1,248 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from interaction_store import get_store
+
+STATE_PATH = os.environ.get("FINE_TUNE_STATE_PATH", "fine_tune_state.db")
+SHARD_DIR = os.environ.get("FINE_TUNE_SHARD_DIR", "fine_tune_shards")
+SHARD_MAX_BYTES = int(os.environ.get("FINE_TUNE_SHARD_BYTES", str(50 * 1024 * 1024)))
+# Largest training file one job uploads; shards beyond it wait for the next job.
+UPLOAD_MAX_BYTES = int(os.environ.get("FINE_TUNE_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+SCORE_THRESHOLD = 0.5
+MIN_EXAMPLES = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (protocol TEXT PRIMARY KEY, segment INTEGER, entry INTEGER);
+CREATE TABLE IF NOT EXISTS seen (protocol TEXT, digest BLOB, PRIMARY KEY (protocol, digest)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shards (path TEXT PRIMARY KEY, protocol TEXT, examples INTEGER, file_id TEXT);
+CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, protocol TEXT, file_id TEXT, status TEXT,
+                                 fine_tuned_model TEXT, created REAL);
+"""
+
+FINISHED_STATUSES = frozenset(["succeeded", "failed", "cancelled"])
+
+
+class TrainingState:
+    """Watermarks, seen-example digests, shard and job bookkeeping kept in one sqlite file."""
+
+    def __init__(self, path=STATE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def watermark(self, protocol: str):
+        row = self.conn.execute("SELECT segment, entry FROM watermarks WHERE protocol = ?", (protocol,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+    def set_watermark(self, protocol: str, cursor):
+        self.conn.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)", (protocol, *cursor))
+
+    def add_digest(self, protocol: str, digest: bytes) -> bool:
+        """Record a digest; return False when it was already there."""
+        cursor = self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?, ?)", (protocol, digest))
+        return cursor.rowcount == 1
+
+    def add_shard(self, protocol: str, path: str, examples: int):
+        self.conn.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?, NULL)", (path, protocol, examples))
+
+    def pending_shards(self, protocol: str):
+        """Return [(path, examples)] of shards that have not been uploaded yet."""
+        return self.conn.execute(
+            "SELECT path, examples FROM shards WHERE protocol = ? AND file_id IS NULL ORDER BY path",
+            (protocol,)).fetchall()
+
+    def add_job(self, protocol: str, job_id: str, file_id: str, paths):
+        """Record a created job and mark the shards it trains on as uploaded."""
+        with self.conn:
+            self.conn.executemany("UPDATE shards SET file_id = ? WHERE path = ?",
+                                  [(file_id, path) for path in paths])
+            self.conn.execute("INSERT INTO jobs VALUES (?, ?, ?, NULL, NULL, ?)",
+                              (job_id, protocol, file_id, time.time()))
+
+    def unfinished_job(self, protocol: str):
+        """Return (job_id, file_id) of the protocol's job that has not been seen to finish, or None."""
+        return self.conn.execute(
+            "SELECT job_id, file_id FROM jobs WHERE protocol = ? AND status IS NULL ORDER BY created DESC",
+            (protocol,)).fetchone()
+
+    def finish_job(self, job_id: str, status: str, fine_tuned_model: str = None):
+        """Record how a job ended; the shards of a job that did not succeed become pending again."""
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, fine_tuned_model = ? WHERE job_id = ?",
+                              (status, fine_tuned_model, job_id))
+            if status != "succeeded":
+                self.conn.execute("UPDATE shards SET file_id = NULL WHERE file_id = "
+                                  "(SELECT file_id FROM jobs WHERE job_id = ?)", (job_id,))
+
+    def latest_model(self, protocol: str):
+        """Return the model of the protocol's newest succeeded job, or None."""
+        row = self.conn.execute(
+            "SELECT fine_tuned_model FROM jobs WHERE protocol = ? AND status = 'succeeded' "
+            "ORDER BY created DESC", (protocol,)).fetchone()
+        return row[0] if row else None
+
+
+def training_examples(interactions):
+    """Strip stored interactions down to the fine-tuning chat format."""
+    for interaction in interactions:
+        yield {"messages": interaction["messages"]}
+
+
+def dedupe(examples, state: TrainingState, protocol: str):
+    """Drop examples whose messages were already written in this or any earlier run."""
+    for example in examples:
+        digest = hashlib.sha1(json.dumps(example["messages"], sort_keys=True).encode("utf-8")).digest()
+        if state.add_digest(protocol, digest):
+            yield example
+
+
+def write_shards(examples, directory: str, max_bytes=SHARD_MAX_BYTES):
+    """Write examples to new shard files of at most max_bytes; yield (path, examples) per shard."""
+    os.makedirs(directory, exist_ok=True)
+    existing = sorted(glob.glob(os.path.join(directory, "shard-*.jsonl")))
+    number = int(os.path.basename(existing[-1])[len("shard-"):-len(".jsonl")]) if existing else 0
+    f, path, size, count = None, None, 0, 0
+    try:
+        for example in examples:
+            line = (json.dumps(example) + "\n").encode("utf-8")
+            if f is not None and size + len(line) > max_bytes:
+                f.close()
+                f = None
+                yield path, count
+            if f is None:
+                number += 1
+                path = os.path.join(directory, f"shard-{number:06d}.jsonl")
+                f, size, count = open(path, "wb"), 0, 0
+            f.write(line)
+            size += len(line)
+            count += 1
+    except BaseException:
+        # Never leave a half-written shard behind for the next run to number after.
+        if f is not None:
+            f.close()
+            f = None
+            os.remove(path)
+        raise
+    finally:
+        if f is not None:
+            f.close()
+    if f is not None:
+        yield path, count
+
+
+def prepare_training_data(protocol: str, store=None, state_path=STATE_PATH, shard_dir=SHARD_DIR,
+                          max_bytes=SHARD_MAX_BYTES, score_threshold=SCORE_THRESHOLD):
+    """Turn interactions logged since the last run into new upload-ready shards.
+
+    Records are streamed from the store between the saved watermark and the
+    current end of the log, so memory use does not grow with its size.
+    Returns [(path, examples)] of the shards written by this run.
+    """
+    store = get_store() if store is None else store
+    store.flush()
+    state = TrainingState(state_path)
+    try:
+        end = store.end_cursor()
+        interactions = store.read_range(state.watermark(protocol), end, protocol=protocol,
+                                        score_above=score_threshold)
+        examples = dedupe(training_examples(interactions), state, protocol)
+        written = []
+        try:
+            with state.conn:
+                for path, count in write_shards(examples, os.path.join(shard_dir, protocol[:-len(".py")]), max_bytes):
+                    written.append((path, count))
+                    state.add_shard(protocol, path, count)
+                state.set_watermark(protocol, end)
+        except BaseException:
+            # The transaction was rolled back, so the shards it recorded must go too.
+            for path, _ in written:
+                os.remove(path)
+            raise
+        return written
+    finally:
+        state.close()
+
+
+def concatenate_shards(paths, target: str):
+    """Stream the shard files one after another into target."""
+    with open(target, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out)
+
+
+def upload_batch(pending, max_bytes=UPLOAD_MAX_BYTES):
+    """Return the oldest pending shards whose files fit in max_bytes, and at least one."""
+    batch, size = [], 0
+    for path, examples in pending:
+        size += os.path.getsize(path)
+        if batch and size > max_bytes:
+            break
+        batch.append((path, examples))
+    return batch
+
+
+def refresh_job(state: TrainingState, protocol: str, client) -> bool:
+    """Look up the protocol's unfinished job; return False while it is still running."""
+    job = state.unfinished_job(protocol)
+    if job is None:
+        return True
+    response = client.fine_tuning.jobs.retrieve(job[0])
+    if response.status not in FINISHED_STATUSES:
+        return False
+    state.finish_job(job[0], response.status, response.fine_tuned_model)
+    logging.info(f"Fine-tuning job {job[0]} {response.status}")
+    return True
+
+
+def fine_tune(protocol: str, model: str, client, state_path=STATE_PATH, **kwargs):
+    """Prepare new shards, then start a fine-tuning job over the oldest pending ones.
+
+    Each job continues from the model of the last job that succeeded, so the
+    fine-tuned model keeps everything it was trained on before. A new job
+    only starts once the previous one has finished. Shards are marked as
+    uploaded when their job has been created, and become pending again if
+    it fails. Returns the job, or None when none was started.
+    """
+    prepare_training_data(protocol, state_path=state_path, **kwargs)
+    state = TrainingState(state_path)
+    try:
+        if not refresh_job(state, protocol, client):
+            logging.info("The previous fine-tuning job is still running.")
+            return None
+        batch = upload_batch(state.pending_shards(protocol))
+        if sum(examples for _, examples in batch) < MIN_EXAMPLES:
+            logging.info("Not enough high-quality data for fine-tuning.")
+            return None
+
+        paths = [path for path, _ in batch]
+        upload_path = os.path.join(os.path.dirname(paths[0]), "upload.jsonl")
+        concatenate_shards(paths, upload_path)
+        try:
+            with open(upload_path, "rb") as f:
+                response = client.files.create(file=f, purpose="fine-tune")
+        finally:
+            os.remove(upload_path)
+
+        try:
+            fine_tune_response = client.fine_tuning.jobs.create(
+                training_file=response.id,
+                model=state.latest_model(protocol) or model,
+                hyperparameters={"n_epochs": 3}
+            )
+        except Exception:
+            client.files.delete(response.id)
+            raise
+        state.add_job(protocol, fine_tune_response.id, response.id, paths)
+        logging.info(f"Fine-tuning job created: {fine_tune_response}")
+        return fine_tune_response
+    finally:
+        state.close()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ai_selector
+import interaction_store
+import metrics
+import session_store
+from pipeline import TARGETS, init_protocols, save_session, session_config
+import structured_logging
+
+LOG_FILE = "worker.log"
+logger = logging.getLogger("worker")
+
+
+def handle_selector(data: dict):
+    return json.loads(ai_selector.determine_protocol(data["user_input"]))
+
+
+def make_target_handler(target: str):
+    update = TARGETS[target][0]
+
+    def handle_target(data: dict):
+        session_id = data.get("session_id")
+        updated = update(data["user_input"], session_config(target, data.get("config"), session_id))
+        save_session(session_id, target, updated)
+        return updated
+    return handle_target
+
+
+ROUTES = {"/selector": handle_selector}
+ROUTES.update({f"/{target}": make_target_handler(target) for target in TARGETS})
+
+
+class ProtocolRequestHandler(BaseHTTPRequestHandler):
+    """Serve the selector and protocol update functions as JSON POST endpoints."""
+
+    # Keep-alive so the server's pooled upstream connections are reused.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_json({"error": f"Unknown route: {self.path}"}, 404)
+            return
+        self.send_body(metrics.render().encode("utf-8"), metrics.CONTENT_TYPE)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        self.status = 500
+        try:
+            self.handle_post()
+        finally:
+            route = self.path if self.path in ROUTES else "unknown"
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, "worker", route, str(self.status))
+
+    def handle_post(self):
+        handler = ROUTES.get(self.path)
+        if handler is None:
+            self.send_json({"error": f"Unknown route: {self.path}"}, 404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self.send_json({"error": "Invalid JSON body"}, 400)
+            return
+        if "user_input" not in data:
+            self.send_json({"error": "Missing user_input"}, 400)
+            return
+
+        try:
+            self.send_json(handler(data))
+        except Exception as e:
+            logger.error(f"Worker error on {self.path}: {str(e)}")
+            self.send_json({"error": str(e)}, 500)
+
+    def send_json(self, payload, status: int = 200):
+        self.send_body(json.dumps(payload).encode("utf-8"), "application/json", status)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        self.status = status
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+class ProtocolServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def warm_up():
+    """Build the lazily created state before forking so every worker shares it."""
+    structured_logging.attach_log_file(logger, LOG_FILE)
+    init_protocols()
+
+
+def serve(host: str = "localhost", port: int = 8001, workers: int = 1):
+    """Bind once, then fork `workers` processes that accept on the shared socket."""
+    warm_up()
+    server = ProtocolServer((host, port), ProtocolRequestHandler)
+    if workers <= 1:
+        server.serve_forever()
+        return
+    # Each process would otherwise keep its own sessions, and a conversation
+    # would lose its config whenever a request lands on another worker.
+    session_store.share_sessions()
+
+    children = set()
+    shutting_down = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Stop serving instead of dying, so the finally below gets to run.
+            # shutdown() waits for serve_forever, which runs on this thread.
+            def stop_child(signum, frame):
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            signal.signal(signal.SIGTERM, stop_child)
+            signal.signal(signal.SIGINT, stop_child)
+            try:
+                server.serve_forever()
+            finally:
+                # os._exit skips atexit, so write out the queued log records, interactions and sessions first.
+                interaction_store.shutdown()
+                session_store.shutdown()
+                structured_logging.shutdown()
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                children.discard(pid)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not shutting_down:
+            logger.error(f"Worker {pid} exited with status {status}, restarting")
+            spawn()
+    server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol worker service backing server.py.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of prefork worker processes")
+    args = parser.parse_args()
+
+    if args.workers > 1 and not hasattr(os, "fork"):
+        sys.exit("Prefork workers need os.fork; run with --workers 1 on this platform")
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()